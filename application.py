@@ -1,5 +1,23 @@
-from flask import Flask,render_template,request
-from pipeline.prediction_pipeline import hybrid_recommendation
+import os
+import hmac
+import time
+from flask import Flask,render_template,request,Response,jsonify
+### prediction_pipeline only needs NumPy at import time ; keep heavier imports
+### (pandas, joblib, tensorflow) out of this module so workers start fast
+from pipeline.prediction_pipeline import hybrid_recommendation,similar_anime_recommendation,search_titles,record_rating,genre_vocabulary
+from pipeline.async_prediction_pipeline import hybrid_recommendation_async,REQUEST_DEADLINE
+from src.logger import get_logger
+from src.metrics import render_metrics,REQUEST_SECONDS,REQUESTS_TOTAL,SEARCH_REQUESTS_TOTAL
+from src.serving_bundle import seed_serving_dir,read_serving_config
+from config.paths_config import SERVING_DIR,SERVING_SEED_DIR,CONFIG_PATH
+
+logger = get_logger(__name__)
+
+### Bearer token of the clients allowed to POST rating events ; the endpoint is off without it
+RATINGS_API_TOKEN = os.getenv("RATINGS_API_TOKEN")
+
+### Publish the bundle baked into this image unless the volume already serves a newer one
+seed_serving_dir(SERVING_SEED_DIR,SERVING_DIR,read_serving_config(CONFIG_PATH).get("keep_versions",3))
 
 app = Flask(__name__)
 
@@ -8,14 +26,134 @@ def home():
     recommendations = None
 
     if request.method == 'POST':
+        start = time.perf_counter()
         try:
             user_id = int(request.form["userID"])
 
             recommendations = hybrid_recommendation(user_id)
+            REQUESTS_TOTAL.inc("ok")
         except Exception as e:
-            print("Erorr occured....")
+            REQUESTS_TOTAL.inc("error")
+            logger.error(f"Error occured while recommending : {e}")
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start,"home")
 
     return render_template('index.html' , recommendations=recommendations)
 
+def genre_args(name):
+    ### ?include=Comedy,Romance or ?include=Comedy&include=Romance
+    return [genre.strip() for value in request.args.getlist(name) for genre in value.split(",") if genre.strip()]
+
+@app.route('/api/recommendations/<int:user_id>')
+def api_recommendations(user_id):
+    start = time.perf_counter()
+    try:
+        recommendations = hybrid_recommendation(
+            user_id,
+            include_genres=genre_args("include"),
+            exclude_genres=genre_args("exclude"),
+        )
+        REQUESTS_TOTAL.inc("ok")
+        return jsonify({"user_id" : user_id , "recommendations" : recommendations})
+    except ValueError as e:
+        REQUESTS_TOTAL.inc("error")
+        return jsonify({"error" : str(e)}),400
+    except Exception:
+        REQUESTS_TOTAL.inc("error")
+        raise
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - start,"api_recommendations")
+
+### Async view (flask[async]) : stages run concurrently and a deadline bounds latency
+@app.route('/api/async/recommendations/<int:user_id>')
+async def api_recommendations_async(user_id):
+    start = time.perf_counter()
+    try:
+        recommendations , partial = await hybrid_recommendation_async(
+            user_id,
+            include_genres=genre_args("include"),
+            exclude_genres=genre_args("exclude"),
+            deadline=request.args.get("deadline",REQUEST_DEADLINE,type=float),
+        )
+        REQUESTS_TOTAL.inc("partial" if partial else "ok")
+        return jsonify({"user_id" : user_id , "recommendations" : recommendations , "partial" : partial})
+    except ValueError as e:
+        REQUESTS_TOTAL.inc("error")
+        return jsonify({"error" : str(e)}),400
+    except Exception:
+        REQUESTS_TOTAL.inc("error")
+        raise
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - start,"api_recommendations_async")
+
+@app.route('/api/similar/<int:anime_id>')
+def api_similar(anime_id):
+    start = time.perf_counter()
+    try:
+        similar = similar_anime_recommendation(
+            anime_id,
+            include_genres=genre_args("include"),
+            exclude_genres=genre_args("exclude"),
+        )
+        REQUESTS_TOTAL.inc("ok")
+        return jsonify({"anime_id" : anime_id , "similar" : similar})
+    except ValueError as e:
+        REQUESTS_TOTAL.inc("error")
+        return jsonify({"error" : str(e)}),400
+    except Exception:
+        REQUESTS_TOTAL.inc("error")
+        raise
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - start,"api_similar")
+
+@app.route('/api/search')
+def api_search():
+    start = time.perf_counter()
+    try:
+        results = search_titles(request.args.get("q",""),n=request.args.get("n",10,type=int))
+        SEARCH_REQUESTS_TOTAL.inc("ok")
+        return jsonify({"query" : request.args.get("q","") , "results" : results})
+    except Exception:
+        SEARCH_REQUESTS_TOTAL.inc("error")
+        raise
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - start,"api_search")
+
+@app.route('/api/autocomplete')
+def api_autocomplete():
+    start = time.perf_counter()
+    try:
+        results = search_titles(request.args.get("q",""),n=request.args.get("n",10,type=int),fuzzy=False)
+        SEARCH_REQUESTS_TOTAL.inc("ok")
+        return jsonify({"query" : request.args.get("q","") , "suggestions" : [result["name"] for result in results]})
+    except Exception:
+        SEARCH_REQUESTS_TOTAL.inc("error")
+        raise
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - start,"api_autocomplete")
+
+@app.route('/api/ratings' , methods=['POST'])
+def api_ratings():
+    if not RATINGS_API_TOKEN:
+        return jsonify({"error" : "Rating events are disabled"}),403
+    if not hmac.compare_digest(request.headers.get("Authorization","").encode(),f"Bearer {RATINGS_API_TOKEN}".encode()):
+        return jsonify({"error" : "Missing or invalid rating events token"}),401
+
+    payload = request.get_json(silent=True) or {}
+    try:
+        user_id , anime_id , rating = int(payload["user_id"]) , int(payload["anime_id"]) , float(payload["rating"])
+        record_rating(user_id,anime_id,rating)
+        return jsonify({"user_id" : user_id , "anime_id" : anime_id , "rating" : rating}),201
+    except (KeyError,TypeError,ValueError) as e:
+        return jsonify({"error" : f"Invalid rating event : {e}"}),400
+
+@app.route('/api/genres')
+def api_genres():
+    return jsonify({"genres" : genre_vocabulary()})
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(),mimetype="text/plain; version=0.0.4")
+
 if __name__=="__main__":
-    app.run(debug=True,host='0.0.0.0',port=5000)
\ No newline at end of file
+    app.run(debug=True,host='0.0.0.0',port=5000)
@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import platform
+import argparse
+import itertools
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+import numpy as np
+
+### Load test of the Flask service : starts N local instances of application.py
+### (N replicas of deployment.yaml) on a bundle built from synthetic data, then
+### replays user ids drawn from a chosen distribution with C concurrent clients
+### and records latency percentiles, error rate and throughput per configuration.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.run_benchmarks import git_commit, write_synthetic_weights
+
+DISTRIBUTIONS = ("uniform", "zipf", "cold")
+
+
+def prepare_workdir(workdir, n_users, n_anime, density, seed):
+    """ Synthetic raw data, processed artifacts, random weights and a published serving bundle """
+    from benchmarks.synthetic_data import generate_synthetic_data
+    from config.paths_config import RAW_DIR, ANIMELIST_CSV, PROCESSED_DIR, CONFIG_PATH, SERVING_DIR
+    from utils.common_functions import read_yaml
+    from src.data_processing import DataProcessor
+    from src.bundle_exporter import BundleExporter
+
+    os.makedirs(os.path.join(workdir, "config"), exist_ok=True)
+    shutil.copy(os.path.join(REPO_ROOT, "config", "config.yaml"), os.path.join(workdir, "config", "config.yaml"))
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        dataset = generate_synthetic_data(RAW_DIR, n_users, n_anime, density, seed)
+        DataProcessor(ANIMELIST_CSV, PROCESSED_DIR).run()
+        write_synthetic_weights(read_yaml(CONFIG_PATH)["model"]["embedding_size"], seed)
+        BundleExporter(SERVING_DIR).run()
+    finally:
+        os.chdir(cwd)
+    return dataset
+
+
+def known_user_ids(workdir):
+    from config.paths_config import SERVING_DIR
+    from src.serving_bundle import BUNDLE_FILES, resolve_bundle_dir
+
+    bundle_dir = resolve_bundle_dir(os.path.join(workdir, SERVING_DIR))
+    if bundle_dir is None:
+        raise FileNotFoundError(f"No serving bundle under {workdir}")
+    return np.load(os.path.join(bundle_dir, BUNDLE_FILES["user_ids"]))
+
+
+def sample_user_ids(user_ids, distribution, size, seed, zipf_s=1.1):
+    """
+    uniform : every known user equally likely ; zipf : a few heavy users get most
+    of the traffic (p ~ 1 / rank^s over a shuffled ranking) ; cold : ids the
+    bundle has never seen, which exercise the unknown-user path.
+    """
+    rng = np.random.default_rng(seed)
+    if distribution == "uniform":
+        return rng.choice(user_ids, size=size)
+    if distribution == "zipf":
+        ranked = rng.permutation(user_ids)
+        weights = 1.0 / np.arange(1, len(ranked) + 1) ** zipf_s
+        return rng.choice(ranked, size=size, p=weights / weights.sum())
+    if distribution == "cold":
+        return int(user_ids.max()) + 1 + rng.integers(0, 1_000_000, size=size)
+    raise ValueError(f"Unknown distribution : {distribution}")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_instances(workdir, n_instances, timeout=60):
+    """ n_instances servers of application.py (threaded, no debug reloader), one port each """
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, BUNDLE_RELOAD_INTERVAL="0", LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"))
+    instances = []
+    for _ in range(n_instances):
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "flask", "--app", "application", "run", "--host", "127.0.0.1", "--port", str(port)],
+            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        instances.append((process, f"http://127.0.0.1:{port}"))
+
+    deadline = time.time() + timeout
+    for process, base_url in instances:
+        while True:
+            try:
+                urllib.request.urlopen(base_url + "/metrics", timeout=1).read()
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if process.poll() is not None or time.time() > deadline:
+                    stop_instances(instances)
+                    raise RuntimeError(f"Instance {base_url} did not start")
+                time.sleep(0.2)
+    return instances
+
+
+def stop_instances(instances):
+    for process, _ in instances:
+        process.terminate()
+    for process, _ in instances:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def request(url, timeout):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            ok = response.status < 400
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run_load(base_urls, endpoint, user_ids, concurrency, duration, timeout=10):
+    """
+    Closed loop : concurrency clients each send their next request as soon as the
+    previous one returns, spread round robin over the instances, for duration seconds.
+    """
+    counter = itertools.count()
+    latencies = [[] for _ in range(concurrency)]
+    failures = [0] * concurrency
+    stop_at = time.perf_counter() + duration
+
+    def client(i):
+        while time.perf_counter() < stop_at:
+            n = next(counter)
+            url = base_urls[n % len(base_urls)] + endpoint.format(user_id=int(user_ids[n % len(user_ids)]))
+            latency, ok = request(url, timeout)
+            latencies[i].append(latency)
+            failures[i] += not ok
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.concatenate([np.array(l) for l in latencies]) if any(latencies) else np.zeros(0)
+    n_requests = len(latencies)
+    n_errors = sum(failures)
+
+    result = {
+        "requests": int(n_requests),
+        "errors": int(n_errors),
+        "error_rate": n_errors / n_requests if n_requests else 0.0,
+        "rps": n_requests / elapsed,
+        "duration": elapsed,
+    }
+    if n_requests:
+        result.update({
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+            "mean": float(latencies.mean()),
+            "max": float(latencies.max()),
+        })
+    return result
+
+
+def compare_load_reports(report, baseline, threshold):
+    """
+    Configurations whose p95 latency grew or whose throughput dropped by more
+    than threshold (fraction) against the baseline report.
+    """
+    regressions = {}
+    for name, result in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None or "p95" not in previous or "p95" not in result:
+            continue
+
+        latency_ratio = result["p95"] / previous["p95"]
+        rps_ratio = result["rps"] / previous["rps"] if previous["rps"] else 1.0
+        print(f"{name:45s} p95 {previous['p95'] * 1000:8.2f} -> {result['p95'] * 1000:8.2f} ms  "
+              f"rps {previous['rps']:8.1f} -> {result['rps']:8.1f}")
+        if latency_ratio > 1 + threshold or rps_ratio < 1 - threshold:
+            regressions[name] = {"p95": latency_ratio, "rps": rps_ratio}
+    return regressions
+
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Flask service with replayed user id distributions")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--anime", type=int, default=2000)
+    parser.add_argument("--density", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=43)
+    parser.add_argument("--workdir", default=None,
+                        help="Directory with artifacts/serving to serve from, prepared with synthetic data when empty")
+    parser.add_argument("--instances", default="1,2", help="Comma separated numbers of server instances")
+    parser.add_argument("--concurrency", default="4,16", help="Comma separated numbers of concurrent clients")
+    parser.add_argument("--distributions", default=",".join(DISTRIBUTIONS))
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load per configuration")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds of unrecorded load before each configuration")
+    parser.add_argument("--endpoint", default="/api/recommendations/{user_id}")
+    parser.add_argument("--output", default="load_test_report.json")
+    parser.add_argument("--compare", default=None, help="Baseline report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed p95 / throughput regression before failing")
+    args = parser.parse_args()
+
+    from config.paths_config import SERVING_DIR
+    from src.serving_bundle import bundle_exists
+
+    output = os.path.abspath(args.output)
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="anime-load-"))
+
+    dataset = None
+    try:
+        if not bundle_exists(os.path.join(workdir, SERVING_DIR)):
+            dataset = prepare_workdir(workdir, args.users, args.anime, args.density, args.seed)
+        user_ids = known_user_ids(workdir)
+
+        results = {}
+        for n_instances in parse_list(args.instances, int):
+            instances = start_instances(workdir, n_instances)
+            base_urls = [base_url for _, base_url in instances]
+            try:
+                for distribution in parse_list(args.distributions):
+                    sampled = sample_user_ids(user_ids, distribution, 100_000, args.seed, args.zipf_s)
+                    for concurrency in parse_list(args.concurrency, int):
+                        if args.warmup > 0:
+                            run_load(base_urls, args.endpoint, sampled, concurrency, args.warmup)
+
+                        name = f"{distribution}/instances={n_instances}/concurrency={concurrency}"
+                        results[name] = run_load(base_urls, args.endpoint, sampled, concurrency, args.duration)
+                        result = results[name]
+                        print(f"{name:45s} rps {result['rps']:8.1f}  p50 {result.get('p50', 0) * 1000:8.2f} ms  "
+                              f"p95 {result.get('p95', 0) * 1000:8.2f} ms  p99 {result.get('p99', 0) * 1000:8.2f} ms  "
+                              f"errors {result['error_rate']:.2%}")
+            finally:
+                stop_instances(instances)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "dataset": dataset,
+        "config": {
+            "endpoint": args.endpoint,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "zipf_s": args.zipf_s,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Load test report written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        regressions = compare_load_reports(report, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions over {args.threshold:.0%} : {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
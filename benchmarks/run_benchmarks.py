@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import asyncio
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+### All artifact paths in config/paths_config.py are relative, so the suite runs
+### the real pipeline code inside a scratch working directory filled with
+### synthetic data instead of touching artifacts/ in the repo.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def time_call(fn, repeat, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    timings = np.array(timings)
+    return {
+        "repeat": int(repeat),
+        "min": float(timings.min()),
+        "median": float(np.median(timings)),
+        "mean": float(timings.mean()),
+        "max": float(timings.max()),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def write_synthetic_weights(embedding_size, seed):
+    import joblib
+    from config.paths_config import (USER2USER_ENCODED, ANIME2ANIME_ENCODED, WEIGHTS_DIR, USER_WEIGHTS_PATH,
+                                     ANIME_WEIGHTS_PATH, USER_WEIGHTS_NPY, ANIME_WEIGHTS_NPY)
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(WEIGHTS_DIR, exist_ok=True)
+
+    for encoded_path, pkl_path, npy_path in [
+        (USER2USER_ENCODED, USER_WEIGHTS_PATH, USER_WEIGHTS_NPY),
+        (ANIME2ANIME_ENCODED, ANIME_WEIGHTS_PATH, ANIME_WEIGHTS_NPY),
+    ]:
+        weights = rng.standard_normal((len(joblib.load(encoded_path)), embedding_size)).astype(np.float32)
+        weights /= np.linalg.norm(weights, axis=1, keepdims=True)
+        joblib.dump(weights, pkl_path)
+        np.save(npy_path, weights)
+
+
+def run_suite(n_users, n_anime, density, repeat, seed):
+    import joblib
+    import pandas as pd
+    from benchmarks.synthetic_data import generate_synthetic_data
+    from config.paths_config import (RAW_DIR, ANIMELIST_CSV, PROCESSED_DIR, CONFIG_PATH, SERVING_DIR, DF, RATING_DF,
+                                     RATINGS_INDEX, USER_WEIGHTS_PATH, ANIME_WEIGHTS_PATH, USER2USER_ENCODED,
+                                     USER2USER_DECODED, ANIME2ANIME_ENCODED, ANIME2ANIME_DECODED)
+    from utils.common_functions import read_yaml
+    from src.data_processing import DataProcessor
+    from src.bundle_exporter import BundleExporter
+    from src.model_evaluation import ModelEvaluation
+    from utils import helpers
+    from pipeline import prediction_pipeline, async_prediction_pipeline
+
+    results = {}
+    dataset = generate_synthetic_data(RAW_DIR, n_users, n_anime, density, seed)
+
+    ### Training side
+    results["data_processing.run"] = time_call(lambda: DataProcessor(ANIMELIST_CSV, PROCESSED_DIR).run(), max(1, repeat // 5))
+
+    processor = DataProcessor(ANIMELIST_CSV, PROCESSED_DIR)
+    processor.load_data(usecols=["user_id", "anime_id", "rating"])
+    processor.filter_users()
+    processor.scale_ratings()
+
+    results["data_processing.encode_data"] = time_call(processor.encode_data, repeat)
+    results["data_processing.build_ratings_index"] = time_call(processor.build_ratings_index, repeat)
+    results["data_processing.split_data"] = time_call(processor.split_data, repeat)
+    processor.process_anime_data()
+    processor.save_genre_bitsets()
+    results["data_processing.build_content_index"] = time_call(processor.build_content_index, max(1, repeat // 5))
+
+    write_synthetic_weights(read_yaml(CONFIG_PATH)["model"]["embedding_size"], seed)
+    BundleExporter(SERVING_DIR).run()
+    results["model_evaluation.evaluate"] = time_call(ModelEvaluation().evaluate, max(1, repeat // 5))
+
+    ### Serving side : the same sampled users / titles for every benchmark
+    rng = np.random.default_rng(seed)
+    user_ids = list(joblib.load(USER2USER_ENCODED).keys())
+    users = [int(u) for u in rng.choice(user_ids, size=min(repeat, len(user_ids)), replace=False)]
+
+    anime_df = pd.read_csv(DF)
+    encoded_anime_ids = set(joblib.load(ANIME2ANIME_ENCODED).keys())
+    titles = anime_df[anime_df.anime_id.isin(encoded_anime_ids)].eng_version.dropna().drop_duplicates(keep=False).tolist()
+    titles = [str(t) for t in rng.choice(titles, size=min(repeat, len(titles)), replace=False)]
+
+    def over(items, fn):
+        iterator = iter(items * (repeat // len(items) + 1))
+        return lambda: fn(next(iterator))
+
+    results["helpers.find_similar_users"] = time_call(
+        over(users, lambda u: helpers.find_similar_users(u, USER_WEIGHTS_PATH, USER2USER_ENCODED, USER2USER_DECODED)), repeat)
+    results["helpers.find_similar_animes"] = time_call(
+        over(titles, lambda t: helpers.find_similar_animes(t, ANIME_WEIGHTS_PATH, ANIME2ANIME_ENCODED, ANIME2ANIME_DECODED, DF)), repeat)
+    results["helpers.get_user_preferences"] = time_call(
+        over(users, lambda u: helpers.get_user_preferences(u, RATING_DF, DF)), repeat)
+    results["helpers.recommend_for_user"] = time_call(
+        over(users, lambda u: helpers.recommend_for_user(u, USER_WEIGHTS_PATH, ANIME_WEIGHTS_PATH, USER2USER_ENCODED, ANIME2ANIME_DECODED, RATINGS_INDEX, DF)), repeat)
+
+    results["bundle.load"] = time_call(lambda: prediction_pipeline.get_serving_bundle(), 1,
+                                       setup=lambda: setattr(prediction_pipeline, "_bundle_manager", None))
+    bundle = prediction_pipeline.get_serving_bundle()
+
+    results["bundle.similar_users"] = time_call(over(users, bundle.similar_users), repeat)
+    results["bundle.user_preferences"] = time_call(over(users, bundle.user_preferences), repeat)
+    results["bundle.recommend_for_user"] = time_call(over(users, bundle.recommend_for_user), repeat)
+    catalog_rows = [int(r) for r in rng.choice(len(bundle.catalog_ids), size=min(repeat, len(bundle.catalog_ids)), replace=False)]
+    results["bundle.similar_titles"] = time_call(over(catalog_rows, bundle.similar_titles), repeat)
+    ### Prefixes and misspellings (two adjacent characters swapped) of real titles
+    queries = [t[:max(1, len(t) // 2)] for t in titles] + [t[:2] + t[3] + t[2] + t[4:] if len(t) > 4 else t for t in titles]
+    results["bundle.search_titles"] = time_call(over(queries, bundle.search_titles), repeat)
+
+    results["hybrid_recommendation"] = time_call(over(users, prediction_pipeline.hybrid_recommendation), repeat)
+    results["hybrid_recommendation_async"] = time_call(
+        over(users, lambda u: asyncio.run(async_prediction_pipeline.hybrid_recommendation_async(u))), repeat)
+    results["hybrid_recommendation_from_artifacts"] = time_call(
+        over(users, prediction_pipeline.hybrid_recommendation_from_artifacts), max(1, repeat // 5))
+
+    return dataset, results
+
+
+def compare_reports(report, baseline, threshold):
+    """
+    Benchmarks whose best time got slower than baseline by more than threshold
+    (fraction). The minimum is the least noisy estimate of the real cost.
+    """
+    regressions = {}
+    for name, result in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None or previous["min"] <= 0:
+            continue
+
+        ratio = result["min"] / previous["min"]
+        print(f"{name:45s} {previous['min'] * 1000:10.3f} ms -> {result['min'] * 1000:10.3f} ms  x{ratio:.2f}")
+        if ratio > 1 + threshold:
+            regressions[name] = ratio
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the training and serving hot paths on synthetic data")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--anime", type=int, default=2000)
+    parser.add_argument("--density", type=float, default=0.25)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=43)
+    parser.add_argument("--workdir", default=None, help="Scratch directory (default : a temporary directory)")
+    parser.add_argument("--output", default="benchmark_report.json")
+    parser.add_argument("--compare", default=None, help="Baseline report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown before failing")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="anime-bench-")
+    os.makedirs(os.path.join(workdir, "config"), exist_ok=True)
+    shutil.copy(os.path.join(REPO_ROOT, "config", "config.yaml"), os.path.join(workdir, "config", "config.yaml"))
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        dataset, results = run_suite(args.users, args.anime, args.density, args.repeat, args.seed)
+    finally:
+        os.chdir(cwd)
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "dataset": dataset,
+        "results": results,
+    }
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark report written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        regressions = compare_reports(report, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions over {args.threshold:.0%} : {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+GENRES = [
+    "Action", "Adventure", "Comedy", "Drama", "Fantasy", "Horror", "Mystery", "Romance",
+    "Sci-Fi", "Slice of Life", "Sports", "Supernatural", "Mecha", "Music", "School", "Shounen",
+    "Shoujo", "Seinen", "Josei", "Psychological", "Thriller", "Historical", "Military", "Magic",
+]
+
+WORDS = [
+    "hero", "school", "world", "journey", "power", "friend", "battle", "secret", "love", "city",
+    "team", "dream", "demon", "robot", "family", "war", "magic", "village", "ninja", "detective",
+    "music", "ghost", "future", "kingdom", "island", "pirate", "spirit", "rival", "tournament", "memory",
+]
+
+
+def generate_synthetic_data(output_dir, n_users=2000, n_anime=2000, density=0.25, seed=43, chunk_size=1000):
+    """
+    Writes animelist.csv, anime.csv and anime_with_synopsis.csv with the columns
+    DataProcessor reads into output_dir.
+
+    Every user rates about density * n_anime titles (binomial), drawn without
+    replacement from a Zipf-like popularity curve. DataProcessor.filter_users
+    drops users with fewer than 400 ratings, so keep density * n_anime above that.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    anime_ids = np.sort(rng.choice(np.arange(1, n_anime * 5), size=n_anime, replace=False))
+    user_ids = np.sort(rng.choice(np.arange(1, n_users * 5), size=n_users, replace=False))
+
+    ### Ratings : Gumbel top-k over log-popularity samples without replacement, a chunk of users at a time
+    log_popularity = -0.8 * np.log(np.arange(1, n_anime + 1))
+    rng.shuffle(log_popularity)
+    counts = np.clip(rng.binomial(n_anime, density, size=n_users), 1, n_anime)
+
+    with open(os.path.join(output_dir, "animelist.csv"), "w", newline="") as f:
+        f.write("user_id,anime_id,rating,watching_status,watched_episodes\n")
+
+        for start in range(0, n_users, chunk_size):
+            stop = min(start + chunk_size, n_users)
+            keys = log_popularity + rng.gumbel(size=(stop - start, n_anime))
+            order = np.argsort(-keys, axis=1)
+
+            chunk_counts = counts[start:stop]
+            rows = np.repeat(np.arange(stop - start), chunk_counts)
+            cols = np.concatenate([order[i, :c] for i, c in enumerate(chunk_counts)])
+
+            chunk = pd.DataFrame({
+                "user_id": user_ids[start:stop][rows],
+                "anime_id": anime_ids[cols],
+                "rating": rng.integers(0, 11, size=len(rows)),
+                "watching_status": rng.integers(1, 7, size=len(rows)),
+                "watched_episodes": rng.integers(0, 27, size=len(rows)),
+            })
+            chunk.to_csv(f, header=False, index=False)
+
+    ### Catalog
+    genres = [", ".join(rng.choice(GENRES, size=rng.integers(1, 5), replace=False)) for _ in range(n_anime)]
+    names = [f"Synthetic Anime {anime_id}" for anime_id in anime_ids]
+    english_names = [name if rng.random() < 0.7 else "Unknown" for name in names]
+
+    pd.DataFrame({
+        "MAL_ID": anime_ids,
+        "Name": [f"Gensaku {anime_id}" for anime_id in anime_ids],
+        "Score": np.round(rng.uniform(1, 10, size=n_anime), 2),
+        "Genres": genres,
+        "English name": english_names,
+        "Japanese name": "Unknown",
+        "Type": rng.choice(["TV", "Movie", "OVA", "ONA"], size=n_anime),
+        "Episodes": rng.integers(1, 100, size=n_anime),
+        "Premiered": "Unknown",
+        "Members": rng.integers(1, 1000000, size=n_anime),
+    }).to_csv(os.path.join(output_dir, "anime.csv"), index=False)
+
+    pd.DataFrame({
+        "MAL_ID": anime_ids,
+        "Name": [f"Gensaku {anime_id}" for anime_id in anime_ids],
+        "Score": "Unknown",
+        "Genres": genres,
+        "sypnopsis": [" ".join(rng.choice(WORDS, size=rng.integers(20, 60))) for _ in range(n_anime)],
+    }).to_csv(os.path.join(output_dir, "anime_with_synopsis.csv"), index=False)
+
+    return {
+        "users": int(n_users),
+        "anime": int(n_anime),
+        "ratings": int(counts.sum()),
+        "density": float(density),
+        "seed": int(seed),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic anime rating data")
+    parser.add_argument("--output-dir", default="artifacts/raw")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--anime", type=int, default=2000)
+    parser.add_argument("--density", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=43)
+    args = parser.parse_args()
+
+    print(generate_synthetic_data(args.output_dir, args.users, args.anime, args.density, args.seed))
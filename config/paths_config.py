@@ -13,10 +13,7 @@ ANIMELIST_CSV = "artifacts/raw/animelist.csv"
 ANIME_CSV = "artifacts/raw/anime.csv"
 ANIMESYNOPSIS_CSV = "artifacts/raw/anime_with_synopsis.csv"
 
-X_TRAIN_ARRAY = os.path.join(PROCESSED_DIR,"X_train_array.pkl")
-X_TEST_ARRAY = os.path.join(PROCESSED_DIR,"X_test_array.pkl")
-Y_TRAIN = os.path.join(PROCESSED_DIR,"y_train.pkl")
-Y_TEST = os.path.join(PROCESSED_DIR,"y_test.pkl")
+SPLITS_DIR = os.path.join(PROCESSED_DIR,"splits")
 
 RATING_DF = os.path.join(PROCESSED_DIR,"rating_df.csv")
 DF = os.path.join(PROCESSED_DIR,"anime_df.csv")
@@ -28,6 +25,12 @@ USER2USER_DECODED = "artifacts/processed/user2user_decoded.pkl"
 ANIME2ANIME_ENCODED = "artifacts/processed/anim2anime_encoded.pkl"
 ANIME2ANIME_DECODED = "artifacts/processed/anim2anime_decoded.pkl"
 
+RATINGS_INDEX = os.path.join(PROCESSED_DIR,"ratings_index.npz")
+GENRE_BITSETS = os.path.join(PROCESSED_DIR,"anime_genre_bitsets.npy")
+GENRE_VOCAB = os.path.join(PROCESSED_DIR,"genre_vocab.json")
+CONTENT_INDEX = os.path.join(PROCESSED_DIR,"content_index.npz")
+TITLE_INDEX = os.path.join(PROCESSED_DIR,"title_index.npz")
+
 
 ###################### MODEL TRAINING #######################333
 
@@ -36,4 +39,23 @@ WEIGHTS_DIR = "artifacts/weights"
 MODEL_PATH = os.path.join(MODEL_DIR,"model.h5")
 ANIME_WEIGHTS_PATH = os.path.join(WEIGHTS_DIR,"anime_weights.pkl")
 USER_WEIGHTS_PATH = os.path.join(WEIGHTS_DIR,"user_weights.pkl")
-CHECKPOINT_FILE_PATH = "artifacts/model_checkpoint/weights.weights.h5"
\ No newline at end of file
+
+ANIME_WEIGHTS_NPY = os.path.join(WEIGHTS_DIR,"anime_weights.npy")
+USER_WEIGHTS_NPY = os.path.join(WEIGHTS_DIR,"user_weights.npy")
+### Prefixes of the quantized tables (<prefix>_values.npy, <prefix>_scales.npy)
+ANIME_WEIGHTS_FLOAT16_PATH = os.path.join(WEIGHTS_DIR,"anime_weights_float16")
+USER_WEIGHTS_FLOAT16_PATH = os.path.join(WEIGHTS_DIR,"user_weights_float16")
+ANIME_WEIGHTS_INT8_PATH = os.path.join(WEIGHTS_DIR,"anime_weights_int8")
+USER_WEIGHTS_INT8_PATH = os.path.join(WEIGHTS_DIR,"user_weights_int8")
+QUANTIZATION_REPORT = os.path.join(WEIGHTS_DIR,"quantization_report.json")
+
+CHECKPOINT_FILE_PATH = "artifacts/model_checkpoint/weights.weights.h5"
+EVALUATION_REPORT = os.path.join(MODEL_DIR,"evaluation_report.json")
+
+
+###################### SERVING #######################
+
+SERVING_DIR = "artifacts/serving"
+### Bundle baked into the serving image, copied to an empty SERVING_DIR volume
+SERVING_SEED_DIR = "artifacts/serving-seed"
+RATINGS_DELTA_LOG = os.path.join(SERVING_DIR,"ratings_delta.log")
@@ -0,0 +1,147 @@
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.logger import get_logger
+from src.metrics import timed
+from pipeline.prediction_pipeline import (use_bundle,get_serving_bundle,filter_genres,fuse_recommendations,
+                                          hybrid_recommendation_from_artifacts)
+
+### Async variant of hybrid_recommendation for the asyncio Flask handlers.
+### Independent stages run concurrently on one bounded thread pool per worker
+### process (NumPy releases the GIL inside the dot products / partitions) and
+### every request has a deadline : stages still running when it expires are
+### dropped and the recommendations are fused from whatever already finished.
+
+logger = get_logger(__name__)
+
+### Threads shared by all requests of a worker process
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_POOL_SIZE", min(8, os.cpu_count() or 1)))
+### Seconds a request may spend before partial results are returned
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", 1.0))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=ASYNC_POOL_SIZE,thread_name_prefix="recommendation-stage")
+    return _executor
+
+
+def _timed_call(stage,fn,*args,**kwargs):
+    with timed(stage):
+        return fn(*args,**kwargs)
+
+
+def run_stage(stage,fn,*args,**kwargs):
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(get_executor(),functools.partial(_timed_call,stage,fn,*args,**kwargs))
+
+
+async def wait_until(tasks,expires):
+    """
+    Results of the tasks (dict key -> future) that finish before the loop time
+    expires, and whether any had to be dropped. A dropped stage keeps its pool
+    thread until it returns : the deadline bounds latency, not the work.
+    partial only ever means a deadline drop ; a stage that raised re-raises
+    its exception here, so the request is counted as an error.
+    """
+    if not tasks:
+        return {},False
+
+    loop = asyncio.get_running_loop()
+    done,pending = await asyncio.wait(tasks.values(),timeout=max(0.0,expires - loop.time()))
+    for task in pending:
+        task.cancel()
+
+    results = {}
+    for key,task in tasks.items():
+        if task not in done:
+            continue
+        if task.exception() is not None:
+            logger.error(f"Stage {key} failed : {task.exception()}")
+            raise task.exception()
+        results[key] = task.result()
+    return results,len(results) < len(tasks)
+
+
+async def hybrid_recommendation_async(user_id , user_weight=0.5, content_weight =0.5, direct_weight=0.0, text_weight=0.0,
+                                      include_genres=None, exclude_genres=None, deadline=REQUEST_DEADLINE):
+    """
+    Same recommendations as hybrid_recommendation when every stage finishes
+    within deadline seconds. Returns (recommendations, partial).
+    """
+    loop = asyncio.get_running_loop()
+    expires = loop.time() + deadline
+
+    if not use_bundle():
+        results,partial = await wait_until({"artifacts" : run_stage("artifacts",hybrid_recommendation_from_artifacts,
+            user_id,user_weight,content_weight,direct_weight,text_weight,include_genres,exclude_genres)},expires)
+        return results.get("artifacts",[]),partial
+
+    with timed("artifact_access"):
+        bundle = get_serving_bundle()
+
+    ### Unknown genres raise ValueError here, before any stage is started
+    bundle.genre_mask(include_genres,exclude_genres)
+
+    #### Stage 1 : similar users, own preferences and direct scoring are independent
+    first = {
+        "similar_users" : run_stage("similar_users",bundle.similar_users,user_id),
+        "preferences" : run_stage("preferences",bundle.user_preferences,user_id),
+    }
+    direct = {}
+    if direct_weight > 0:
+        direct["direct_scoring"] = run_stage("direct_scoring",bundle.recommend_for_user,user_id,
+                                             include_genres=include_genres,exclude_genres=exclude_genres)
+
+    results,partial = await wait_until(first,expires)
+
+    user_recommended_animes = []
+    if "similar_users" in results and "preferences" in results:
+        aggregated,dropped = await wait_until({"aggregation" : run_stage("aggregation",bundle.user_recommendations,
+                                               results["similar_users"][0],results["preferences"])},expires)
+        partial |= dropped
+        if "aggregation" in aggregated:
+            user_recommended_animes = aggregated["aggregation"][0].tolist()
+
+    #### Stage 2 : one lookup per seed title, all independent (direct scoring may still be running)
+    second = dict(direct)
+    for anime in user_recommended_animes:
+        second[("content",anime)] = run_stage("content_similarity",bundle.similar_animes,anime,
+                                               include_genres=include_genres,exclude_genres=exclude_genres)
+    if text_weight > 0:
+        for anime,row in zip(user_recommended_animes,bundle.anime_catalog_index[user_recommended_animes]):
+            second[("text",anime)] = run_stage("text_similarity",bundle.similar_titles,row,
+                                                include_genres=include_genres,exclude_genres=exclude_genres)
+
+    results,dropped = await wait_until(second,expires)
+    partial |= dropped
+
+    content_recommended_animes = []
+    text_recommended_titles = []
+    for anime in user_recommended_animes:
+        if ("content",anime) in results:
+            content_recommended_animes.extend(results[("content",anime)][0].tolist())
+        if ("text",anime) in results:
+            text_recommended_titles.extend(results[("text",anime)][0].tolist())
+
+    direct_recommended_animes = results["direct_scoring"][0].tolist() if "direct_scoring" in results else []
+
+    with timed("fusion"):
+        user_votes = filter_genres(bundle,user_recommended_animes,include_genres,exclude_genres)
+        recommendations = fuse_recommendations(
+            bundle,
+            [(user_votes,user_weight),(content_recommended_animes,content_weight),(direct_recommended_animes,direct_weight)],
+            [(text_recommended_titles,text_weight)],
+        )
+
+    if partial:
+        logger.warning(f"Partial recommendations for user {user_id} : stages dropped at the {deadline}s deadline or failed")
+
+    return recommendations,partial
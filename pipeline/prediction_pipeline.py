@@ -1,39 +1,345 @@
+import os
+import threading
 from config.paths_config import *
-from utils.helpers import *
+from src.logger import get_logger
+from src.metrics import timed
 
-def hybrid_recommendation(user_id , user_weight=0.5, content_weight =0.5):
+### Lazy-import policy : this module is imported by the Flask app, so it must stay
+### NumPy-only at import time. pandas / joblib helpers are only pulled in by the
+### artifact fallback below and tensorflow is never imported on the serving path.
+
+logger = get_logger(__name__)
+
+### Seconds between checks for a newly published bundle, 0 disables hot reload
+BUNDLE_RELOAD_INTERVAL = float(os.getenv("BUNDLE_RELOAD_INTERVAL", 30))
+### 0 keeps this process out of the delta log compaction (one worker compacts at a time)
+RATINGS_COMPACTION = os.getenv("RATINGS_COMPACTION", "1") != "0"
+
+_bundle_manager = None
+_ratings_compactor = None
+### Concurrent first requests of a threaded worker must create one manager / compactor
+_singletons_lock = threading.RLock()
+
+def get_bundle_manager():
+    global _bundle_manager
+    if _bundle_manager is None:
+        with _singletons_lock:
+            if _bundle_manager is None:
+                from src.bundle_reloader import BundleManager
+                manager = BundleManager(SERVING_DIR,BUNDLE_RELOAD_INTERVAL)
+                manager.start()
+                _bundle_manager = manager
+                start_ratings_compactor()
+    return _bundle_manager
+
+def start_ratings_compactor():
+    global _ratings_compactor
+    if _ratings_compactor is None and RATINGS_COMPACTION:
+        with _singletons_lock:
+            if _ratings_compactor is None:
+                from src.ratings_compactor import RatingsCompactor
+                try:
+                    compactor = RatingsCompactor(SERVING_DIR)
+                    compactor.start()
+                    _ratings_compactor = compactor
+                except Exception as e:
+                    logger.error(f"Ratings compactor not started : {e}")
+    return _ratings_compactor
+
+def get_serving_bundle():
+    ### One bundle per request : a reload in between never mixes two versions
+    return get_bundle_manager().current
+
+
+def use_bundle():
+    from src.serving_bundle import bundle_exists
+    return (_bundle_manager is not None and _bundle_manager.loaded) or bundle_exists(SERVING_DIR)
+
+
+def hybrid_recommendation(user_id , user_weight=0.5, content_weight =0.5, direct_weight=0.0, text_weight=0.0, include_genres=None, exclude_genres=None):
+    if not use_bundle():
+        return hybrid_recommendation_from_artifacts(user_id,user_weight,content_weight,direct_weight,text_weight,include_genres,exclude_genres)
+
+    with timed("artifact_access"):
+        bundle = get_serving_bundle()
+
+    rows = rank_hybrid(bundle,user_id,user_weight,content_weight,direct_weight,text_weight,include_genres,exclude_genres)
+    return bundle.catalog_names[rows].tolist()
+
+
+def rank_hybrid(bundle , user_id , user_weight=0.5, content_weight =0.5, direct_weight=0.0, text_weight=0.0, include_genres=None, exclude_genres=None, n=10):
+    """ Catalog rows hybrid_recommendation serves for user_id from bundle, best first (also scored offline by ModelEvaluation) """
 
     ## User Recommndation
 
-    similar_users =find_similar_users(user_id,USER_WEIGHTS_PATH,USER2USER_ENCODED,USER2USER_DECODED)
-    user_pref = get_user_preferences(user_id,RATING_DF, DF)
-    user_recommended_animes =get_user_recommendations(similar_users,user_pref,DF, SYNOPSIS_DF,RATING_DF)
+    with timed("similar_users"):
+        similar_users , _ = bundle.similar_users(user_id)
+
+    with timed("preferences"):
+        user_pref = bundle.user_preferences(user_id)
+
+    with timed("aggregation"):
+        user_recommended_animes , _ = bundle.user_recommendations(similar_users,user_pref)
+        user_recommended_animes = user_recommended_animes.tolist()
+
+    #### Content recommendation
+    ### Seeds stay unfiltered ("similar to X but only Comedy") ; genre filters are
+    ### applied as masks inside every top-k and to the user stage contribution
+    content_recommended_animes = []
+
+    with timed("content_similarity"):
+        for anime in user_recommended_animes:
+            similar_animes , _ = bundle.similar_animes(anime,include_genres=include_genres,exclude_genres=exclude_genres)
+            content_recommended_animes.extend(similar_animes.tolist())
+
+    #### Synopsis similarity : catalog rows, may be titles nobody has rated yet
+    text_recommended_titles = []
+
+    if text_weight > 0:
+        with timed("text_similarity"):
+            for row in bundle.anime_catalog_index[user_recommended_animes]:
+                similar_titles , _ = bundle.similar_titles(row,include_genres=include_genres,exclude_genres=exclude_genres)
+                text_recommended_titles.extend(similar_titles.tolist())
+
+    #### Direct user -> anime scoring
+    direct_recommended_animes = []
+
+    if direct_weight > 0:
+        with timed("direct_scoring"):
+            direct_recommended_animes , _ = bundle.recommend_for_user(user_id,include_genres=include_genres,exclude_genres=exclude_genres)
+            direct_recommended_animes = direct_recommended_animes.tolist()
+
+    with timed("fusion"):
+        user_votes = filter_genres(bundle,user_recommended_animes,include_genres,exclude_genres)
+        rows = fuse_rows(
+            bundle,
+            [(user_votes,user_weight),(content_recommended_animes,content_weight),(direct_recommended_animes,direct_weight)],
+            [(text_recommended_titles,text_weight)],
+            n,
+        )
+
+    logger.debug("[hybrid_recommendation] user_id=%s similar_users=%s user_recommended=%s content_recommended=%s",
+                 user_id, len(similar_users), len(user_recommended_animes), len(content_recommended_animes))
+
+    return rows
+
+
+def filter_genres(bundle , animes , include_genres=None , exclude_genres=None):
+    ### User stage votes : seeds stay unfiltered, their own contribution does not
+    allowed = bundle.genre_mask(include_genres,exclude_genres)
+    if allowed is None:
+        return animes
+    return [anime for anime in animes if allowed[anime]]
+
+
+def fuse_recommendations(bundle , anime_lists , title_lists , n=10):
+    return bundle.catalog_names[fuse_rows(bundle,anime_lists,title_lists,n)].tolist()
+
+
+def fuse_rows(bundle , anime_lists , title_lists , n=10):
+    """
+    Weighted vote over (encoded animes, weight) and (catalog rows, weight) lists,
+    fused on catalog rows so text neighbours and embedding results share one key.
+    Returns the n best rows that have a name.
+    """
+    combined_scores = {}
+    catalog_rows = bundle.anime_catalog_index
+
+    def add(rows,weight):
+        for row in rows:
+            if row >= 0:
+                combined_scores[row] = combined_scores.get(row,0) + weight
+
+    for animes , weight in anime_lists:
+        add(catalog_rows[animes],weight)
+
+    for rows , weight in title_lists:
+        add(rows,weight)
+
+    sorted_animes = sorted(combined_scores.items() , key=lambda x:x[1] , reverse=True)
+    return [row for row , score in sorted_animes if bundle.catalog_names[row]][:n]
+
+
+def hybrid_recommendation_from_artifacts(user_id , user_weight=0.5, content_weight =0.5, direct_weight=0.0, text_weight=0.0, include_genres=None, exclude_genres=None):
+    with timed("artifact_access"):
+        from utils.helpers import (find_similar_users,get_user_preferences,get_user_recommendations,find_similar_animes,
+                                   find_similar_titles,recommend_for_user,load_rating_deltas,get_genre_mask)
+        from utils.genres import parse_genres
+
+    ### Unknown genres raise ValueError (a 400) against GENRE_VOCAB, as bundle.genre_mask does
+    get_genre_mask(include_genres,exclude_genres)
+
+    ### Similarity lookups mask with the genre bitsets before their top-k ; only the
+    ### similar users' votes (names + genre strings) are filtered on the strings
+    def genre_allowed(genres):
+        genres = set(parse_genres(genres))
+        return set(include_genres or ()) <= genres and not genres & set(exclude_genres or ())
+
+    ## User Recommndation
+
+    with timed("similar_users"):
+        similar_users =find_similar_users(user_id,USER_WEIGHTS_PATH,USER2USER_ENCODED,USER2USER_DECODED)
+
+    with timed("preferences"):
+        ### One read of the delta log for the whole request
+        deltas = load_rating_deltas()
+        user_pref = get_user_preferences(user_id,RATING_DF, DF, deltas)
+
+    with timed("aggregation"):
+        user_recommended_animes =get_user_recommendations(similar_users,user_pref,DF, SYNOPSIS_DF,RATING_DF, deltas=deltas)
+
+    logger.debug("get_user_recommendations completed")
 
-    print(f"get_user_recommendations completed")
-    
 
     user_recommended_anime_list = user_recommended_animes["anime_name"].tolist()
 
     #### Content recommendation
     content_recommended_animes = []
 
-    for anime in user_recommended_anime_list:
-        similar_animes = find_similar_animes(anime, ANIME_WEIGHTS_PATH, ANIME2ANIME_ENCODED, ANIME2ANIME_DECODED, DF)
+    with timed("content_similarity"):
+        for anime in user_recommended_anime_list:
+            similar_animes = find_similar_animes(anime, ANIME_WEIGHTS_PATH, ANIME2ANIME_ENCODED, ANIME2ANIME_DECODED, DF, include_genres=include_genres, exclude_genres=exclude_genres)
+
+            if similar_animes is not None and not similar_animes.empty:
+                content_recommended_animes.extend(similar_animes["name"].tolist())
+            else:
+                logger.debug("No similar anime found %s", anime)
+
+    text_recommended_titles = []
+
+    if text_weight > 0:
+        with timed("text_similarity"):
+            for anime in user_recommended_anime_list:
+                similar_titles = find_similar_titles(anime, CONTENT_INDEX, DF, include_genres=include_genres, exclude_genres=exclude_genres)
+                text_recommended_titles.extend(similar_titles["name"].dropna().tolist())
+
+    #### Direct user -> anime scoring
+    direct_recommended_animes = []
+
+    if direct_weight > 0:
+        with timed("direct_scoring"):
+            direct_recommended_animes = recommend_for_user(user_id, USER_WEIGHTS_PATH, ANIME_WEIGHTS_PATH, USER2USER_ENCODED, ANIME2ANIME_DECODED, RATINGS_INDEX, DF, include_genres=include_genres, exclude_genres=exclude_genres, deltas=deltas)["name"].dropna().tolist()
+
+    with timed("fusion"):
+        combined_scores = {}
+
+        for anime , genres in zip(user_recommended_anime_list , user_recommended_animes.get("Genres",[])):
+            if not genre_allowed(genres):
+                continue
+            combined_scores[anime] = combined_scores.get(anime,0) + user_weight
+
+        for anime in content_recommended_animes:
+            combined_scores[anime] = combined_scores.get(anime,0) + content_weight
+
+        for anime in text_recommended_titles:
+            combined_scores[anime] = combined_scores.get(anime,0) + text_weight
+
+        for anime in direct_recommended_animes:
+            combined_scores[anime] = combined_scores.get(anime,0) + direct_weight
+
+        sorted_animes = sorted(combined_scores.items() , key=lambda x:x[1] , reverse=True)
+
+    return [anime for anime , score in sorted_animes[:10]]
+
+
+def similar_anime_recommendation(anime_id , n=10, text_weight=0.5, include_genres=None, exclude_genres=None):
+    """
+    Titles similar to anime_id : cosine of the learned anime embeddings blended
+    with synopsis similarity. Titles without ratings (not in the embeddings)
+    are served from synopsis similarity alone.
+    """
+    if not use_bundle():
+        from utils.helpers import find_similar_animes
+        similar = find_similar_animes(anime_id, ANIME_WEIGHTS_PATH, ANIME2ANIME_ENCODED, ANIME2ANIME_DECODED, DF, n=n, include_genres=include_genres, exclude_genres=exclude_genres)
+        return similar["name"].dropna().tolist()
+
+    with timed("artifact_access"):
+        bundle = get_serving_bundle()
+
+    catalog_row = bundle.encode_catalog(anime_id)
+    if catalog_row is None:
+        raise ValueError(f"Unknown anime id : {anime_id}")
 
-        if similar_animes is not None and not similar_animes.empty:
-            content_recommended_animes.extend(similar_animes["name"].tolist())
-        else:
-            print(f"No similar anime found {anime}")
-    
     combined_scores = {}
 
-    for anime in user_recommended_anime_list:
-        combined_scores[anime] = combined_scores.get(anime,0) + user_weight
+    with timed("text_similarity"):
+        similar_titles , similarity = bundle.similar_titles(catalog_row,n,include_genres=include_genres,exclude_genres=exclude_genres)
+
+    encoded_anime = bundle.encode_anime(anime_id)
+    if encoded_anime is None:
+        text_weight = 1.0
+    else:
+        with timed("content_similarity"):
+            similar_animes , anime_similarity = bundle.similar_animes(encoded_anime,n,include_genres=include_genres,exclude_genres=exclude_genres)
+        for row , score in zip(bundle.anime_catalog_index[similar_animes].tolist(),anime_similarity.tolist()):
+            if row >= 0:
+                combined_scores[row] = (1 - text_weight) * score
 
-    for anime in content_recommended_animes:
-        combined_scores[anime] = combined_scores.get(anime,0) + content_weight  
+    for row , score in zip(similar_titles.tolist(),similarity.tolist()):
+        combined_scores[row] = combined_scores.get(row,0) + text_weight * score
 
     sorted_animes = sorted(combined_scores.items() , key=lambda x:x[1] , reverse=True)
+    names = bundle.catalog_names[[row for row , score in sorted_animes]]
+    return [name for name in names.tolist() if name][:n]
+
+
+def search_titles(query , n=10, fuzzy=True):
+    """ Catalog titles matching a partial or misspelled query, best match first """
+    if not use_bundle():
+        import pandas as pd
+        from utils.title_search import TitleIndex
+        df = pd.read_csv(DF)
+        index = TitleIndex.load(TITLE_INDEX)
+        results = index.search(query,n) if fuzzy else index.prefix(query,n)
+        return [{"anime_id" : int(df.anime_id.values[row]) , "name" : df.eng_version.values[row] , "score" : score} for row , score in results]
+
+    with timed("artifact_access"):
+        bundle = get_serving_bundle()
+
+    with timed("title_search"):
+        rows , scores = bundle.search_titles(query,n,fuzzy=fuzzy)
+
+    return [
+        {"anime_id" : int(anime_id) , "name" : str(name) , "score" : float(score)}
+        for anime_id , name , score in zip(bundle.catalog_ids[rows],bundle.catalog_names[rows],scores)
+    ]
+
+
+def genre_vocabulary():
+    """ Genre names the include / exclude filters accept """
+    if not use_bundle():
+        import json
+        with open(GENRE_VOCAB) as f:
+            return json.load(f)
+
+    return get_serving_bundle().genres
+
+
+def record_rating(user_id , anime_id , rating):
+    """ Appends a rating event to this pod's delta log segment ; preferences and seen masking see it on the next request """
+    from src.ratings_delta import append_ratings , segment_path
+
+    ### Events of ids the model has no embedding for could never be served nor merged
+    if use_bundle():
+        bundle = get_serving_bundle()
+        known_user = bundle.encode_user(user_id) is not None
+        known_anime = bundle.encode_anime(anime_id) is not None
+        rating_scale = bundle.rating_scale
+    else:
+        import joblib
+        import numpy as np
+        known_user = user_id in joblib.load(USER2USER_ENCODED)
+        known_anime = anime_id in joblib.load(ANIME2ANIME_ENCODED)
+        with np.load(RATINGS_INDEX) as ratings_index:
+            rating_scale = ratings_index["rating_scale"].tolist()
 
-    return [anime for anime , score in sorted_animes[:10]] 
+    if not known_user:
+        raise ValueError(f"Unknown user_id {user_id}")
+    if not known_anime:
+        raise ValueError(f"Unknown anime_id {anime_id}")
+    low , high = rating_scale or (rating , rating)
+    if not low <= rating <= high:
+        raise ValueError(f"Rating {rating} outside of [{low}, {high}]")
 
+    os.makedirs(os.path.dirname(RATINGS_DELTA_LOG),exist_ok=True)
+    append_ratings(segment_path(RATINGS_DELTA_LOG),[user_id],[anime_id],[rating])
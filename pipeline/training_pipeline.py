@@ -2,6 +2,8 @@ from utils.common_functions import read_yaml
 from config.paths_config import *
 from src.data_processing import DataProcessor
 from src.model_training import ModelTraining
+from src.model_evaluation import ModelEvaluation
+from src.bundle_exporter import BundleExporter
 
 if __name__=="__main__":
     data_processor = DataProcessor(ANIMELIST_CSV,PROCESSED_DIR)
@@ -10,3 +12,17 @@ if __name__=="__main__":
     model_trainer = ModelTraining(PROCESSED_DIR)
     model_trainer.train_model()
 
+    bundle_exporter = BundleExporter(SERVING_DIR)
+    bundle_exporter.export()
+
+    ### Scores the direct scorer and the hybrid ranking of the exported bundle ;
+    ### raises when the metrics miss the gates, so the bundle is never published
+    model_evaluation = ModelEvaluation(CONFIG_PATH,experiment=model_trainer.experiment)
+    try:
+        model_evaluation.run(bundle_dir=bundle_exporter.output_dir)
+    except Exception:
+        bundle_exporter.discard()
+        raise
+
+    bundle_exporter.publish()
+
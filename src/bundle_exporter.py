@@ -0,0 +1,227 @@
+import os
+import json
+import shutil
+import joblib
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from src.logger import get_logger
+from src.custom_exception import CustomException
+from src.serving_bundle import BUNDLE_FILES,QUANTIZED_FILES,MANIFEST_FILE,DELTA_LOG_FILE,write_current,prune_versions,publish_lock
+from src.ratings_delta import read_ratings,count_ratings,scale_ratings
+from src.ratings_compactor import merge_ratings
+from utils.quantization import quantized_paths,SERVING_QUANTIZATION_DTYPES
+from utils.common_functions import read_yaml
+from config.paths_config import *
+
+logger = get_logger(__name__)
+
+class BundleExporter:
+    """
+    Packs the processed data and trained weights into a self-contained
+    serving bundle that ServingBundle can load with NumPy alone. Every export
+    is a new version directory under serving_dir ; CURRENT is only repointed
+    once the bundle is complete, which is what running workers reload from.
+    """
+    def __init__(self,serving_dir):
+        self.serving_dir = serving_dir
+        self.config = read_yaml(CONFIG_PATH).get("serving",{})
+        self.version = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        self.output_dir = os.path.join(serving_dir,self.version)
+        self.files = {}
+
+        os.makedirs(self.output_dir,exist_ok=True)
+        logger.info(f"Bundle Export Initialized for version {self.version}")
+
+    def _save(self,bundle_file,**arrays):
+        path = os.path.join(self.output_dir,BUNDLE_FILES[bundle_file])
+        if path.endswith(".npz"):
+            np.savez(path,**arrays)
+        else:
+            np.save(path,arrays["array"])
+        self.files[BUNDLE_FILES[bundle_file]] = os.path.getsize(path)
+
+    def export_embeddings(self):
+        try:
+            self._save("user_embeddings",array=np.load(USER_WEIGHTS_NPY).astype(np.float32))
+            self._save("anime_embeddings",array=np.load(ANIME_WEIGHTS_NPY).astype(np.float32))
+
+            quantization = self.config.get("bundle_quantization")
+            if quantization and quantization not in SERVING_QUANTIZATION_DTYPES:
+                raise ValueError(f"bundle_quantization must be one of {SERVING_QUANTIZATION_DTYPES}, got {quantization}")
+            if quantization:
+                sources = {"user" : USER_WEIGHTS_INT8_PATH , "anime" : ANIME_WEIGHTS_INT8_PATH}
+                for table,prefix in QUANTIZED_FILES.items():
+                    targets = quantized_paths(os.path.join(self.output_dir,prefix.format(dtype=quantization)))
+                    for part,source in quantized_paths(sources[table]).items():
+                        shutil.copyfile(source,targets[part])
+                        self.files[os.path.basename(targets[part])] = os.path.getsize(targets[part])
+
+            logger.info("Embeddings exported to serving bundle")
+        except Exception as e:
+            raise CustomException("Failed to export embeddings",e)
+
+    def export_id_maps(self):
+        try:
+            user2user_decoded = joblib.load(USER2USER_DECODED)
+            anime2anime_decoded = joblib.load(ANIME2ANIME_DECODED)
+
+            self.user_ids = np.array([user2user_decoded[i] for i in range(len(user2user_decoded))],dtype=np.int64)
+            self.anime_ids = np.array([anime2anime_decoded[i] for i in range(len(anime2anime_decoded))],dtype=np.int64)
+
+            self._save("user_ids",array=self.user_ids)
+            self._save("anime_ids",array=self.anime_ids)
+            logger.info("Id maps exported to serving bundle")
+        except Exception as e:
+            raise CustomException("Failed to export id maps",e)
+
+    def export_catalog(self):
+        try:
+            df = pd.read_csv(DF)
+            anime_id = df["anime_id"].values.astype(np.int64)
+
+            self.catalog_ids = anime_id
+            self._save("catalog",
+                anime_id = anime_id,
+                name = np.array(df["eng_version"].fillna("").astype(str).tolist(),dtype=str),
+                genres = np.array(df["Genres"].fillna("").astype(str).tolist(),dtype=str),
+            )
+
+            ### Row of every encoded anime in the catalog, -1 when it has no catalog entry
+            row_of = pd.Series(np.arange(len(anime_id)),index=anime_id)
+            row_of = row_of[~row_of.index.duplicated()]
+            catalog_index = row_of.reindex(self.anime_ids).fillna(-1).values.astype(np.int64)
+
+            self._save("anime_catalog_index",array=catalog_index)
+            logger.info("Catalog exported to serving bundle")
+        except Exception as e:
+            raise CustomException("Failed to export catalog",e)
+
+    def export_ratings_index(self):
+        try:
+            with np.load(RATINGS_INDEX) as ratings_index:
+                indptr,indices,ratings = ratings_index["indptr"],ratings_index["indices"],ratings_index["ratings"]
+                self.rating_scale = ratings_index["rating_scale"].tolist()
+
+            ### Rating events logged on the serving volume never reach rating_df : fold them
+            ### in here, so workers only replay the events logged after this export
+            delta_log = os.path.join(self.serving_dir,DELTA_LOG_FILE)
+            self.delta_offset = count_ratings(delta_log)
+            records = read_ratings(delta_log,0,self.delta_offset)
+            if len(records):
+                records = records[np.argsort(records["timestamp"],kind="stable")]
+                users = pd.Series(np.arange(len(self.user_ids)),index=self.user_ids).reindex(records["user_id"]).fillna(-1).values.astype(np.int64)
+                animes = pd.Series(np.arange(len(self.anime_ids)),index=self.anime_ids).reindex(records["anime_id"]).fillna(-1).values.astype(np.int64)
+                known = (users >= 0) & (animes >= 0)
+                indptr,indices,ratings = merge_ratings(
+                    indptr,indices,ratings,
+                    users[known],animes[known],scale_ratings(records["rating"][known],self.rating_scale),
+                )
+                logger.info(f"{int(known.sum())} logged rating events merged into the ratings index")
+
+            self._save("ratings_indptr",array=indptr)
+            self._save("ratings_indices",array=indices)
+            self._save("ratings_values",array=ratings)
+            logger.info("Ratings index exported to serving bundle")
+        except Exception as e:
+            raise CustomException("Failed to export ratings index",e)
+
+    def export_genres(self):
+        try:
+            self._save("genre_bitsets",array=np.load(GENRE_BITSETS))
+            with open(GENRE_VOCAB) as f:
+                self.genres = json.load(f)
+            logger.info("Genre bitsets exported to serving bundle")
+        except Exception as e:
+            raise CustomException("Failed to export genre bitsets",e)
+
+    def export_content(self):
+        try:
+            with np.load(CONTENT_INDEX) as content_index:
+                ### Content rows are catalog rows : both come from anime_df.csv in the same order
+                if not np.array_equal(content_index["anime_id"],self.catalog_ids):
+                    raise ValueError("Content index is not aligned with the anime catalog")
+
+                self._save("content_embeddings",array=content_index["embeddings"].astype(np.float32))
+                self._save("content_neighbors",neighbors=content_index["neighbors"],scores=content_index["scores"])
+                self._save("catalog_genre_bitsets",array=content_index["genre_bitsets"])
+            logger.info("Content index exported to serving bundle")
+        except Exception as e:
+            raise CustomException("Failed to export content index",e)
+
+    def export_title_index(self):
+        try:
+            with np.load(TITLE_INDEX) as title_index:
+                if title_index["entry_row"].max(initial=-1) >= len(self.catalog_ids):
+                    raise ValueError("Title index is not aligned with the anime catalog")
+                self._save("title_index",**{name : title_index[name] for name in title_index.files})
+            logger.info("Title index exported to serving bundle")
+        except Exception as e:
+            raise CustomException("Failed to export title index",e)
+
+    def write_manifest(self):
+        try:
+            user_embeddings = np.load(os.path.join(self.output_dir,BUNDLE_FILES["user_embeddings"]),mmap_mode="r")
+            anime_embeddings = np.load(os.path.join(self.output_dir,BUNDLE_FILES["anime_embeddings"]),mmap_mode="r")
+
+            manifest = {
+                "version" : self.version,
+                "created_at" : datetime.now().isoformat(),
+                "n_users" : int(user_embeddings.shape[0]),
+                "n_anime" : int(anime_embeddings.shape[0]),
+                "embedding_size" : int(user_embeddings.shape[1]),
+                "quantization" : self.config.get("bundle_quantization"),
+                "rescore_factor" : self.config.get("rescore_factor",4),
+                "genres" : self.genres,
+                "rating_scale" : self.rating_scale,
+                ### Log records before it are merged by export_ratings_index
+                "delta_offset" : int(self.delta_offset),
+                "files" : self.files,
+            }
+
+            with open(os.path.join(self.output_dir,MANIFEST_FILE),"w") as f:
+                json.dump(manifest,f,indent=2)
+            logger.info(f"Manifest written for bundle version {manifest['version']}")
+        except Exception as e:
+            raise CustomException("Failed to write bundle manifest",e)
+
+    def publish(self):
+        try:
+            with publish_lock(self.serving_dir):
+                write_current(self.serving_dir,self.version)
+                logger.info(f"Serving bundle {self.version} published")
+
+                for version in prune_versions(self.serving_dir,self.config.get("keep_versions",3)):
+                    logger.info(f"Removed old serving bundle {version}")
+        except Exception as e:
+            raise CustomException("Failed to publish serving bundle",e)
+
+    def discard(self):
+        ### Exported but never published (e.g. it missed the evaluation gates)
+        shutil.rmtree(self.output_dir,ignore_errors=True)
+        logger.info(f"Serving bundle {self.version} discarded")
+
+    def export(self):
+        try:
+            self.export_embeddings()
+            self.export_id_maps()
+            self.export_catalog()
+            self.export_ratings_index()
+            self.export_genres()
+            self.export_content()
+            self.export_title_index()
+            self.write_manifest()
+
+            logger.info("Serving bundle exported sucesfully ....")
+        except CustomException as e:
+            logger.error(str(e))
+            raise
+
+    def run(self):
+        self.export()
+        self.publish()
+
+
+if __name__=="__main__":
+    bundle_exporter = BundleExporter(SERVING_DIR)
+    bundle_exporter.run()
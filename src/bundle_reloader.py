@@ -0,0 +1,185 @@
+import os
+import threading
+import numpy as np
+from src.logger import get_logger
+from src.serving_bundle import (ServingBundle,MANIFEST_FILE,DELTA_LOG_FILE,VALIDATED_FILE,REJECTED_FILE,resolve_bundle_dir,
+                                write_current,list_versions,mark_version,publish_lock)
+
+logger = get_logger(__name__)
+
+
+def validate_bundle(bundle):
+    """
+    Consistency checks run before a bundle is allowed to serve traffic. Scanning
+    the memory-mapped tables also pulls them into the page cache, so the first
+    requests after the switch do not pay for page faults.
+    """
+    manifest = bundle.manifest
+    n_users,n_anime = len(bundle.user_ids),len(bundle.anime_ids)
+
+    if bundle.user_embeddings.shape[0] != n_users or manifest.get("n_users") != n_users:
+        raise ValueError("user embeddings / ids / manifest disagree on the number of users")
+    if bundle.anime_embeddings.shape[0] != n_anime or manifest.get("n_anime") != n_anime:
+        raise ValueError("anime embeddings / ids / manifest disagree on the number of animes")
+    if bundle.user_embeddings.shape[1] != bundle.anime_embeddings.shape[1]:
+        raise ValueError("user and anime embeddings have different sizes")
+    if len(bundle.genre_bitsets) != n_anime or len(bundle.genres) > 64 * bundle.genre_bitsets.shape[1]:
+        raise ValueError("genre bitsets do not match the animes / genre vocabulary")
+    n_catalog = len(bundle.catalog_ids)
+    if len(bundle.content_embeddings) != n_catalog or len(bundle.content_neighbors) != n_catalog or len(bundle.catalog_genre_bitsets) != n_catalog:
+        raise ValueError("content index does not match the catalog")
+    if bundle.content_neighbors.max(initial=-1) >= n_catalog:
+        raise ValueError("content neighbours point outside the catalog")
+    if bundle.title_index.entry_row.max(initial=-1) >= n_catalog:
+        raise ValueError("title index points outside the catalog")
+    if len(bundle.anime_catalog_index) != n_anime or bundle.anime_catalog_index.max(initial=-1) >= len(bundle.catalog_ids):
+        raise ValueError("anime catalog index does not match the catalog")
+
+    indptr = bundle.indptr
+    if len(indptr) != n_users + 1 or indptr[0] != 0 or indptr[-1] != len(bundle.indices) or len(bundle.indices) != len(bundle.ratings):
+        raise ValueError("ratings index is not a valid CSR layout for the users")
+    if np.any(np.diff(indptr) < 0) or bundle.indices.max(initial=0) >= n_anime:
+        raise ValueError("ratings index has decreasing offsets or unknown animes")
+
+    for name,embeddings in [("user",bundle.user_embeddings),("anime",bundle.anime_embeddings),("content",bundle.content_embeddings)]:
+        ### A table served quantized is checked on its int8 values / scales only :
+        ### scanning the float32 table would pull all of it into the page cache
+        ### although only rescored candidate rows are read while serving
+        if name in bundle.quantized:
+            quantized = bundle.quantized[name]
+            if quantized["values"].shape != embeddings.shape or quantized["scales"].shape != embeddings.shape[:1]:
+                raise ValueError(f"quantized {name} embeddings do not match the float32 table")
+            if not np.isfinite(quantized["scales"]).all():
+                raise ValueError(f"quantized {name} embeddings contain non finite scales")
+        elif not np.isfinite(embeddings).all():
+            raise ValueError(f"{name} embeddings contain non finite values")
+
+    if n_users > 1 and len(bundle.similar_users(int(bundle.user_ids[0]),n=1)[0]) == 0:
+        raise ValueError("similar_users smoke query returned nothing")
+    if n_anime > 1 and len(bundle.similar_animes(0,n=1)[0]) == 0:
+        raise ValueError("similar_animes smoke query returned nothing")
+
+
+class BundleManager:
+    """
+    Holds the ServingBundle that requests read and swaps in new versions
+    published under serving_dir. Loading and validation run on a background
+    thread ; the switch is a single reference assignment, so a request that
+    already took `current` finishes on the old bundle and the next one sees the
+    new. A bundle that fails validation is never served and CURRENT is pointed
+    back at the version still in use.
+    """
+    def __init__(self,serving_dir,reload_interval=30):
+        self.serving_dir = serving_dir
+        self.reload_interval = reload_interval
+
+        self._bundle = None
+        self._loaded_key = None
+        self._rejected = set()
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def loaded(self):
+        return self._bundle is not None
+
+    @property
+    def current(self):
+        bundle = self._bundle
+        if bundle is None:
+            self.reload()
+            bundle = self._bundle
+            if bundle is None:
+                raise FileNotFoundError(f"No valid serving bundle in {self.serving_dir}")
+        return bundle
+
+    def _key(self,bundle_dir):
+        return (os.path.abspath(bundle_dir),os.path.getmtime(os.path.join(bundle_dir,MANIFEST_FILE)))
+
+    def _candidates(self):
+        bundle_dir = resolve_bundle_dir(self.serving_dir)
+        if bundle_dir is None:
+            return []
+
+        candidates = [bundle_dir]
+        if self._bundle is None and os.path.isdir(self.serving_dir):
+            ### Nothing served yet : older versions are the fallback if the published one is bad
+            older = list_versions(self.serving_dir)[::-1]
+            candidates += [os.path.join(self.serving_dir,name) for name in older
+                           if os.path.abspath(os.path.join(self.serving_dir,name)) != os.path.abspath(bundle_dir)]
+        return candidates
+
+    def reload(self):
+        with self._reload_lock:
+            switched = False
+            for bundle_dir in self._candidates():
+                key = self._key(bundle_dir)
+                if key == self._loaded_key:
+                    break
+                if key in self._rejected:
+                    continue
+
+                try:
+                    bundle = ServingBundle(bundle_dir,delta_log=os.path.join(self.serving_dir,DELTA_LOG_FILE))
+                    validate_bundle(bundle)
+                except Exception as e:
+                    self._rejected.add(key)
+                    mark_version(bundle_dir,REJECTED_FILE)
+                    logger.error(f"Serving bundle {bundle_dir} rejected : {e}")
+                    continue
+
+                ### prune_versions only counts validated versions and never removes the last one
+                if not os.path.exists(os.path.join(bundle_dir,VALIDATED_FILE)):
+                    mark_version(bundle_dir,VALIDATED_FILE)
+
+                ### Read the unmerged log here, off the request path, before requests see the bundle
+                if bundle.deltas is not None:
+                    bundle.deltas.refresh()
+
+                previous = self._bundle
+                self._bundle = bundle
+                self._loaded_key = key
+
+                logger.info(f"Switched serving bundle {previous.manifest.get('version') if previous else None} -> {bundle.manifest.get('version')}")
+                switched = True
+                break
+
+            self.rollback()
+            return switched
+
+    def rollback(self):
+        """ Point CURRENT back at the bundle being served when it names a rejected version """
+        active = self._bundle
+        if active is None or os.path.abspath(active.bundle_dir) == os.path.abspath(self.serving_dir):
+            return
+
+        try:
+            with publish_lock(self.serving_dir):
+                published = resolve_bundle_dir(self.serving_dir)
+                if published is not None and os.path.abspath(published) == os.path.abspath(active.bundle_dir):
+                    return
+                ### Published after reload() looked : the next reload validates it
+                if published is not None and self._key(published) not in self._rejected:
+                    return
+
+                write_current(self.serving_dir,os.path.basename(os.path.normpath(active.bundle_dir)))
+                logger.info(f"CURRENT rolled back to {active.manifest.get('version')}")
+        except OSError as e:
+            logger.warning(f"Could not roll back CURRENT in {self.serving_dir} : {e}")
+
+    def _watch(self):
+        while not self._stop.wait(self.reload_interval):
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"Error while checking for a new serving bundle {e}")
+
+    def start(self):
+        ### Started lazily in each worker process : threads do not survive a fork
+        if self.reload_interval and self._thread is None:
+            self._thread = threading.Thread(target=self._watch,name="bundle-reloader",daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -55,6 +55,8 @@ class DataIngestion:
             logger.info("Data Ingestion Completed...")
         except CustomException as ce:
             logger.error(f"CustomException: {str(ce)}")
+            ### A failed download must stop the retrain Job, not train on the data baked into the image
+            raise
         finally:
             logger.info("Data Ingestion DONE...")
 
@@ -5,21 +5,27 @@ import joblib
 from src.logger import get_logger
 from src.custom_exception import CustomException
 from config.paths_config import *
+from utils.common_functions import read_yaml,save_split
+from utils.genres import build_genre_vocab,build_genre_bitsets
+from utils.content import build_tfidf,reduce_dimensions,build_neighbor_index
+from utils.title_search import build_title_index
+import json
 import sys
 
 logger = get_logger(__name__)
 
 class DataProcessor:
-    def __init__(self,input_file,output_dir):
+    def __init__(self,input_file,output_dir,config_path=CONFIG_PATH):
         self.input_file = input_file
         self.output_dir =  output_dir
+        self.config = read_yaml(config_path).get("data_processing",{})
 
         self.rating_df = None
         self.anime_df = None
-        self.X_train_array = None
-        self.X_test_array = None
-        self.y_train = None
-        self.y_test = None
+        self.splits = {}
+        self.ratings_index = None
+        self.genre_vocab = []
+        self.rating_scale = None
 
         self.user2user_encoded = {}
         self.user2user_decoded = {}
@@ -50,6 +56,7 @@ class DataProcessor:
             max_rating =max(self.rating_df["rating"])
 
             self.rating_df["rating"] = self.rating_df["rating"].apply(lambda x: (x-min_rating)/(max_rating-min_rating)).values.astype(np.float64)
+            self.rating_scale = (float(min_rating),float(max_rating))
             logger.info("Scalind done for Processing ")
         except Exception as e:
             raise CustomException("Failed to scale data",sys)
@@ -58,7 +65,7 @@ class DataProcessor:
         try:
             ### Users
             user_ids = self.rating_df["user_id"].unique().tolist()
-            print(f"len of user_ids {len(user_ids)}")
+            logger.debug(f"len of user_ids {len(user_ids)}")
             self.user2user_encoded = {x : i for i , x in enumerate(user_ids)}
             self.user2user_decoded = {i : x for i , x in enumerate(user_ids)}
             self.rating_df["user"] = self.rating_df["user_id"].map(self.user2user_encoded)
@@ -74,30 +81,53 @@ class DataProcessor:
         except Exception as e:
             raise CustomException("Failed to encode data",sys)
     
-    def split_data(self, test_size=1000 , random_state=43):
+    def split_data(self, fractions=None , random_state=None):
         try:
-            self.rating_df = self.rating_df.sample(frac=1,random_state=43).reset_index(drop=True)
-            X = self.rating_df[["user","anime"]].values
-            y = self.rating_df["rating"]
+            fractions = fractions or self.config.get("split",{"train" : 0.98 , "validation" : 0.01 , "test" : 0.01})
+            random_state = self.config.get("random_state",43) if random_state is None else random_state
 
-            train_indices = self.rating_df.shape[0] - test_size
+            if not np.isclose(sum(fractions.values()),1.0) or fractions.get("train",0) <= 0 or fractions.get("validation",0) <= 0:
+                raise ValueError(f"Split fractions must sum to 1 with train and validation shares : {fractions}")
 
-            X_train , X_test , y_train , y_test = (
-                    X[:train_indices],
-                    X[train_indices :],
-                    y[:train_indices],
-                    y[train_indices:],
-                    )
-            self.X_train_array = [X_train[: , 0] , X_train[: ,1]]
-            self.X_test_array = [X_test[: , 0] , X_test[: ,1]]
-            self.y_train = y_train
-            self.y_test = y_test
+            ### One permutation index shared by compact column arrays : no shuffled copy of the frame
+            columns = {
+                "user" : self.rating_df["user"].values.astype(np.int32),
+                "anime" : self.rating_df["anime"].values.astype(np.int32),
+                "rating" : self.rating_df["rating"].values.astype(np.float32),
+            }
+            permutation = np.random.default_rng(random_state).permutation(len(self.rating_df))
+
+            bounds = np.round(np.cumsum([0] + list(fractions.values())) * len(permutation)).astype(np.int64)
+            self.splits = {
+                split : {column : values[permutation[start:stop]] for column,values in columns.items()}
+                for split,start,stop in zip(fractions,bounds[:-1],bounds[1:])
+            }
 
-            logger.info("Data splitted sucesfullyy")
+            sizes = {split : len(arrays["user"]) for split,arrays in self.splits.items()}
+            logger.info(f"Data splitted sucesfullyy {sizes}")
 
         except Exception as e:
             raise CustomException("Failed to split data",sys)
     
+    def build_ratings_index(self):
+        try:
+            ### CSR layout : ratings of encoded user u live in indices/ratings[indptr[u]:indptr[u+1]]
+            users = self.rating_df["user"].values
+            order = np.argsort(users, kind="stable")
+
+            counts = np.bincount(users, minlength=len(self.user2user_encoded))
+            indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+
+            self.ratings_index = {
+                "indptr" : indptr,
+                "indices" : self.rating_df["anime"].values[order].astype(np.int32),
+                "ratings" : self.rating_df["rating"].values[order].astype(np.float32),
+            }
+            logger.info("Ratings index built for Users")
+        except Exception as e:
+            raise CustomException("Failed to build ratings index",sys)
+
     def save_artifacts(self):
         try:
             artifacts = {
@@ -111,12 +141,12 @@ class DataProcessor:
                 joblib.dump(data, os.path.join(self.output_dir,f"{name}.pkl"))
                 logger.info(f"{name} saved sucesfully in processed directory")
             
-            joblib.dump(self.X_train_array,X_TRAIN_ARRAY)
-            joblib.dump(self.X_test_array , X_TEST_ARRAY)
-            joblib.dump(self.y_train , Y_TRAIN)
-            joblib.dump(self.y_test , Y_TEST)
+            for split,arrays in self.splits.items():
+                save_split(SPLITS_DIR,split,arrays)
 
             self.rating_df.to_csv(RATING_DF , index=False)
+            ### rating_scale lets serving scale raw ratings from the delta log the same way
+            np.savez(RATINGS_INDEX , rating_scale=np.array(self.rating_scale) , **self.ratings_index)
 
             logger.info("ALl the training testing data as well as rating_df is saved now..")
         except Exception as e:
@@ -136,7 +166,7 @@ class DataProcessor:
                     if name is np.nan:
                         name = df[df.anime_id == anime_id].Name.values[0]
                 except:
-                    print("Error")
+                    logger.error(f"No name found for anime {anime_id}")
                 return name
                 
             df["anime_id"] = df["MAL_ID"]
@@ -149,26 +179,92 @@ class DataProcessor:
                     kind="quicksort",
                     na_position="last")
                 
-            df = df[["anime_id" ,"eng_version","Score","Genres","Episodes","Type","Premiered","Members"]]
+            df = df[["anime_id" ,"eng_version","Score","Genres","Episodes","Type","Premiered","Members","Name"]]
 
             df.to_csv(DF,index=False)
             synopsis_df.to_csv(SYNOPSIS_DF,index=False)
+            self.anime_df = df
 
             logger.info("DF AND SYNOPSIS_Df saved sucesfullyy...")
 
         except Exception as e:
             raise CustomException("Failed to save animje and anime_synopsis data",sys)
     
+    def save_genre_bitsets(self):
+        try:
+            ### One row per encoded anime, aligned with the anime embeddings
+            genres = self.anime_df.drop_duplicates("anime_id").set_index("anime_id")["Genres"]
+            anime_ids = [self.anime2anime_decoded[i] for i in range(len(self.anime2anime_decoded))]
+            genre_strings = genres.reindex(anime_ids).tolist()
+
+            vocab = build_genre_vocab(genres.tolist())
+            bitsets = build_genre_bitsets(genre_strings,vocab)
+            self.genre_vocab = vocab
+
+            np.save(GENRE_BITSETS,bitsets)
+            with open(GENRE_VOCAB,"w") as f:
+                json.dump(vocab,f)
+
+            logger.info(f"Genre bitsets saved for {len(vocab)} genres")
+        except Exception as e:
+            raise CustomException("Failed to build genre bitsets",sys)
+
+    def build_content_index(self):
+        try:
+            ### One row per catalog title (anime_df.csv order), rated or not : titles
+            ### missing from anime2anime_encoded get neighbours from their text alone
+            config = self.config.get("content",{})
+            synopsis_df = pd.read_csv(SYNOPSIS_DF)
+            synopsis = synopsis_df.drop_duplicates("MAL_ID").set_index("MAL_ID")["sypnopsis"]
+
+            anime_ids = self.anime_df["anime_id"].values.astype(np.int64)
+            genre_strings = self.anime_df["Genres"].tolist()
+            texts = synopsis.reindex(anime_ids).tolist()
+
+            tfidf,vocab = build_tfidf(
+                texts,genre_strings,
+                min_df=config.get("min_df",2),
+                max_df=config.get("max_df",0.5),
+                max_features=config.get("max_features",20000),
+                genre_weight=config.get("genre_weight",2.0),
+            )
+            embeddings = reduce_dimensions(tfidf,config.get("dimensions",128),self.config.get("random_state",43))
+            neighbors,scores = build_neighbor_index(embeddings,config.get("neighbors",50))
+
+            np.savez(CONTENT_INDEX,
+                anime_id = anime_ids,
+                embeddings = embeddings,
+                neighbors = neighbors,
+                scores = scores,
+                genre_bitsets = build_genre_bitsets(genre_strings,self.genre_vocab),
+            )
+            logger.info(f"Content index saved : {tfidf.shape[0]} titles , {len(vocab)} terms , {embeddings.shape[1]} dimensions")
+        except Exception as e:
+            raise CustomException("Failed to build content index",sys)
+
+    def save_title_index(self):
+        try:
+            ### Rows are anime_df.csv rows, like the content index
+            title_index = build_title_index(self.anime_df["eng_version"].tolist(),self.anime_df["Name"].tolist())
+            np.savez(TITLE_INDEX,**title_index)
+            logger.info(f"Title index saved : {len(title_index['entry_row'])} titles , {len(title_index['grams'])} trigrams")
+        except Exception as e:
+            raise CustomException("Failed to build title index",sys)
+
     def run(self):
         try:
             self.load_data(usecols=["user_id","anime_id","rating"])
             self.filter_users()
             self.scale_ratings()
             self.encode_data()
+            self.build_ratings_index()
             self.split_data()
             self.save_artifacts()
 
             self.process_anime_data()
+            self.save_genre_bitsets()
+            self.build_content_index()
+            self.save_title_index()
 
             logger.info("Data Processing Pipeline Run sucesfully .... Congrats")
         except CustomException as e:
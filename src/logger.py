@@ -7,13 +7,16 @@ os.makedirs(LOGS_DIR,exist_ok=True)
 
 LOG_FILE = os.path.join(LOGS_DIR, f"log_{datetime.now().strftime('%Y-%m-%d')}.log")
 
+### LOG_LEVEL=DEBUG turns on the per-request traces of the recommender helpers
+LOG_LEVEL = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+
 logging.basicConfig(
     filename=LOG_FILE,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+    level=LOG_LEVEL
 )
 
 def get_logger(name):
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
+    logger.setLevel(LOG_LEVEL)
     return logger
\ No newline at end of file
@@ -0,0 +1,107 @@
+import time
+import threading
+from contextlib import contextmanager
+
+### Minimal Prometheus text-format metrics : no client library needed in the serving image.
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self,name,description,label_name=None,buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_name = label_name
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self,value,label=None):
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = {"counts" : [0] * len(self.buckets) , "sum" : 0.0 , "count" : 0}
+
+            for i,bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def _labels(self,label,extra=None):
+        pairs = []
+        if self.label_name is not None:
+            pairs.append(f'{self.label_name}="{label}"')
+        if extra is not None:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}" , f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label,series in sorted(self._series.items(),key=lambda x:str(x[0])):
+                for bound,count in zip(self.buckets,series["counts"]):
+                    lines.append(self.name + "_bucket" + self._labels(label,'le="%s"' % bound) + f" {count}")
+                lines.append(self.name + "_bucket" + self._labels(label,'le="+Inf"') + f" {series['count']}")
+                lines.append(f"{self.name}_sum{self._labels(label)} {series['sum']}")
+                lines.append(f"{self.name}_count{self._labels(label)} {series['count']}")
+        return "\n".join(lines)
+
+
+class Counter:
+    def __init__(self,name,description,label_name=None):
+        self.name = name
+        self.description = description
+        self.label_name = label_name
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self,label=None,amount=1):
+        with self._lock:
+            self._values[label] = self._values.get(label,0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}" , f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label,value in sorted(self._values.items(),key=lambda x:str(x[0])):
+                labels = f'{{{self.label_name}="{label}"}}' if self.label_name is not None else ""
+                lines.append(f"{self.name}{labels} {value}")
+        return "\n".join(lines)
+
+
+STAGE_SECONDS = Histogram(
+    "recommendation_stage_seconds",
+    "Time spent in each stage of hybrid_recommendation",
+    label_name="stage",
+)
+REQUEST_SECONDS = Histogram(
+    "recommendation_request_seconds",
+    "End to end latency of recommendation requests",
+    label_name="endpoint",
+)
+REQUESTS_TOTAL = Counter(
+    "recommendation_requests_total",
+    "Recommendation requests by outcome",
+    label_name="status",
+)
+
+SEARCH_REQUESTS_TOTAL = Counter(
+    "search_requests_total",
+    "Title search and autocomplete requests by outcome",
+    label_name="status",
+)
+
+REGISTRY = [STAGE_SECONDS , REQUEST_SECONDS , REQUESTS_TOTAL , SEARCH_REQUESTS_TOTAL]
+
+
+@contextmanager
+def timed(stage,histogram=STAGE_SECONDS):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start,stage)
+
+
+def render_metrics():
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
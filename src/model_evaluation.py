@@ -0,0 +1,208 @@
+import os
+import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from src.logger import get_logger
+from src.custom_exception import CustomException
+from utils.common_functions import read_yaml,load_split
+from config.paths_config import *
+
+logger = get_logger(__name__)
+
+def build_csr(users,animes,n_users,ratings=None):
+    order = np.argsort(users,kind="stable")
+    indptr = np.zeros(n_users + 1,dtype=np.int64)
+    np.cumsum(np.bincount(users,minlength=n_users),out=indptr[1:])
+    if ratings is None:
+        return indptr,np.asarray(animes)[order]
+    return indptr,np.asarray(animes)[order],np.asarray(ratings,dtype=np.float32)[order]
+
+
+class ModelEvaluation:
+    """
+    Offline ranking quality on the held-out test split, for two rankers :
+      - the direct user -> anime scorer : every user with a relevant test
+        interaction is scored against the whole catalog in blocks (one matrix
+        multiplication per block), already seen train / validation items are
+        masked out and recall@k, NDCG@k and catalog coverage are computed from
+        the top-k of each block ;
+      - the served hybrid ranking (hybrid_recommendation with its default
+        weights), run on the exported bundle for a sample of those users and
+        reported as hybrid_recall@k / hybrid_ndcg@k. Only evaluated when a
+        bundle directory is given.
+    """
+    def __init__(self,config_path=CONFIG_PATH,experiment=None):
+        try:
+            self.config = read_yaml(config_path).get("evaluation",{})
+            self.experiment = experiment
+
+            self.k_values = sorted(self.config.get("k",[10]))
+            self.relevance_threshold = self.config.get("relevance_threshold",0.6)
+            self.block_size = self.config.get("block_size",2048)
+            self.n_jobs = self.config.get("n_jobs",os.cpu_count() or 1)
+            self.min_metrics = self.config.get("min_metrics",{})
+            self.hybrid_users = self.config.get("hybrid_users",500)
+            self.random_state = self.config.get("random_state",43)
+
+            logger.info("Model Evaluation initialized..")
+        except Exception as e:
+            raise CustomException("Error loading evaluation configuration",e)
+
+    def load_data(self):
+        try:
+            self.user_weights = np.load(USER_WEIGHTS_NPY,mmap_mode="r")
+            self.anime_weights = np.ascontiguousarray(np.load(ANIME_WEIGHTS_NPY),dtype=np.float32)
+            n_users,n_anime = len(self.user_weights),len(self.anime_weights)
+
+            ### Seen = everything the model was fitted or early-stopped on
+            train = load_split(SPLITS_DIR,"train")
+            validation = load_split(SPLITS_DIR,"validation")
+            seen_users = np.concatenate([train["user"],validation["user"]])
+            seen_animes = np.concatenate([train["anime"],validation["anime"]])
+            seen_ratings = np.concatenate([train["rating"],validation["rating"]])
+            self.seen_indptr,self.seen_indices,self.seen_ratings = build_csr(seen_users,seen_animes,n_users,seen_ratings)
+
+            test = load_split(SPLITS_DIR,"test")
+            relevant = np.asarray(test["rating"]) >= self.relevance_threshold
+            self.relevant_indptr,self.relevant_indices = build_csr(
+                np.asarray(test["user"])[relevant],np.asarray(test["anime"])[relevant],n_users)
+
+            self.eval_users = np.flatnonzero(np.diff(self.relevant_indptr))
+            self.n_anime = n_anime
+
+            logger.info(f"Evaluation data loaded : {len(self.eval_users)} users with held-out relevant items")
+        except Exception as e:
+            raise CustomException("Failed to load evaluation data",e)
+
+    @staticmethod
+    def _block_matrix(users,indptr,indices,n_cols):
+        """ (row, col) coordinates of the CSR rows of users, rows renumbered 0..len(users) """
+        counts = indptr[users + 1] - indptr[users]
+        rows = np.repeat(np.arange(len(users)),counts)
+        starts = np.repeat(indptr[users] - np.cumsum(counts) + counts,counts)
+        cols = indices[starts + np.arange(counts.sum())]
+        return rows,cols,counts
+
+    def evaluate_block(self,users):
+        max_k = min(self.k_values[-1],self.n_anime)
+
+        scores = np.dot(self.user_weights[users],self.anime_weights.T)
+
+        rows,cols,_ = self._block_matrix(users,self.seen_indptr,self.seen_indices,self.n_anime)
+        scores[rows,cols] = -np.inf
+
+        top = np.argpartition(-scores,max_k - 1,axis=1)[:,:max_k]
+        top_scores = np.take_along_axis(scores,top,axis=1)
+        top = np.take_along_axis(top,np.argsort(-top_scores,axis=1),axis=1)
+
+        relevant = np.zeros(scores.shape,dtype=bool)
+        rows,cols,n_relevant = self._block_matrix(users,self.relevant_indptr,self.relevant_indices,self.n_anime)
+        relevant[rows,cols] = True
+
+        hits = np.take_along_axis(relevant,top,axis=1)
+        discounts = 1.0 / np.log2(np.arange(2,max_k + 2))
+
+        result = {"top" : {} }
+        for k in self.k_values:
+            k_hits = hits[:,:k]
+            ideal = np.cumsum(discounts)[np.minimum(n_relevant,k) - 1]
+
+            result[f"recall@{k}"] = float((k_hits.sum(axis=1) / n_relevant).sum())
+            result[f"ndcg@{k}"] = float(((k_hits * discounts[:k]).sum(axis=1) / ideal).sum())
+            result["top"][k] = np.unique(top[:,:k])
+        return result
+
+    def evaluate_hybrid(self,bundle_dir):
+        """
+        Served hybrid ranking of a sample of the evaluation users. The bundle's
+        ratings index is cut back to the train / validation interactions so the
+        held-out items stay unseen, as in evaluate_block. One ranking call per
+        user (the hybrid stages are not vectorised over users), hence the sample.
+        """
+        from src.serving_bundle import ServingBundle
+        from pipeline.prediction_pipeline import rank_hybrid
+
+        bundle = ServingBundle(bundle_dir)
+        bundle.indptr,bundle.indices,bundle.ratings = self.seen_indptr,self.seen_indices,self.seen_ratings
+
+        rng = np.random.default_rng(self.random_state)
+        users = rng.choice(self.eval_users,size=min(self.hybrid_users,len(self.eval_users)),replace=False)
+
+        max_k = self.k_values[-1]
+        discounts = 1.0 / np.log2(np.arange(2,max_k + 2))
+        totals = {f"{metric}@{k}" : 0.0 for k in self.k_values for metric in ("hybrid_recall","hybrid_ndcg")}
+
+        for user in users:
+            relevant_animes = self.relevant_indices[self.relevant_indptr[user]:self.relevant_indptr[user + 1]]
+            relevant_rows = bundle.anime_catalog_index[relevant_animes]
+
+            rows = rank_hybrid(bundle,int(bundle.user_ids[user]),n=max_k)
+            hits = np.isin(np.asarray(rows,dtype=np.int64),relevant_rows[relevant_rows >= 0])
+
+            for k in self.k_values:
+                ideal = np.cumsum(discounts)[min(len(relevant_animes),k) - 1]
+                totals[f"hybrid_recall@{k}"] += hits[:k].sum() / len(relevant_animes)
+                totals[f"hybrid_ndcg@{k}"] += (hits[:k] * discounts[:len(hits[:k])]).sum() / ideal
+
+        metrics = {name : float(total / len(users)) for name,total in totals.items()}
+        metrics["hybrid_users"] = int(len(users))
+        return metrics
+
+    def evaluate(self,bundle_dir=None):
+        try:
+            self.load_data()
+            if len(self.eval_users) == 0:
+                raise ValueError("No held-out relevant interactions to evaluate")
+
+            blocks = [self.eval_users[i:i + self.block_size] for i in range(0,len(self.eval_users),self.block_size)]
+
+            ### BLAS and the NumPy kernels release the GIL, so threads evaluate blocks in parallel
+            with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+                results = list(executor.map(self.evaluate_block,blocks))
+
+            metrics = {"users" : int(len(self.eval_users))}
+            for k in self.k_values:
+                metrics[f"recall@{k}"] = sum(r[f"recall@{k}"] for r in results) / len(self.eval_users)
+                metrics[f"ndcg@{k}"] = sum(r[f"ndcg@{k}"] for r in results) / len(self.eval_users)
+                recommended = np.unique(np.concatenate([r["top"][k] for r in results]))
+                metrics[f"coverage@{k}"] = len(recommended) / self.n_anime
+
+            if bundle_dir is not None:
+                metrics.update(self.evaluate_hybrid(bundle_dir))
+
+            logger.info(f"Evaluation metrics : {metrics}")
+
+            os.makedirs(MODEL_DIR,exist_ok=True)
+            with open(EVALUATION_REPORT,"w") as f:
+                json.dump(metrics,f,indent=2)
+
+            if self.experiment is not None:
+                self.experiment.log_metrics(metrics,prefix="eval")
+
+            return metrics
+        except Exception as e:
+            logger.error(str(e))
+            raise CustomException("Error during Model Evaluation",e)
+
+    def check_gates(self,metrics):
+        failed = {
+            name : (metrics.get(name),minimum) for name,minimum in self.min_metrics.items()
+            if metrics.get(name) is None or metrics[name] < minimum
+        }
+        if failed:
+            logger.error(f"Evaluation gates failed : {failed}")
+            return False
+
+        logger.info("Evaluation gates passed")
+        return True
+
+    def run(self,bundle_dir=None):
+        metrics = self.evaluate(bundle_dir)
+        if not self.check_gates(metrics):
+            raise ValueError(f"Model did not pass the evaluation gates {self.min_metrics}")
+        return metrics
+
+
+if __name__=="__main__":
+    model_evaluation = ModelEvaluation()
+    model_evaluation.run()
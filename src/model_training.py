@@ -1,4 +1,5 @@
 import joblib
+import json
 import comet_ml
 import numpy as np
 import os
@@ -6,6 +7,8 @@ from tensorflow.keras.callbacks import ModelCheckpoint,LearningRateScheduler,Ten
 from src.logger import get_logger
 from src.custom_exception import CustomException
 from src.base_model import BaseModel
+from utils.common_functions import read_yaml,load_split
+from utils.quantization import save_quantized_embeddings,compare_quantization
 from config.paths_config import *
 
 logger = get_logger(__name__)
@@ -23,10 +26,14 @@ class ModelTraining:
     
     def load_data(self):
         try:
-            X_train_array = joblib.load(X_TRAIN_ARRAY)
-            X_test_array = joblib.load(X_TEST_ARRAY)
-            y_train = joblib.load(Y_TRAIN)
-            y_test = joblib.load(Y_TEST)
+            ### Memory-mapped int32 / float32 columns straight from the .npy splits
+            train = load_split(SPLITS_DIR,"train")
+            validation = load_split(SPLITS_DIR,"validation")
+
+            X_train_array = [train["user"],train["anime"]]
+            X_test_array = [validation["user"],validation["anime"]]
+            y_train = train["rating"]
+            y_test = validation["rating"]
 
             logger.info("Data loaded sucesfully for Model Trainig")
             return X_train_array,X_test_array,y_train,y_test
@@ -126,6 +133,12 @@ class ModelTraining:
             joblib.dump(user_weights,USER_WEIGHTS_PATH)
             joblib.dump(anime_weights,ANIME_WEIGHTS_PATH)
 
+            ### float32 .npy copies can be memory-mapped for full precision rescoring
+            np.save(USER_WEIGHTS_NPY,user_weights.astype(np.float32))
+            np.save(ANIME_WEIGHTS_NPY,anime_weights.astype(np.float32))
+
+            self.export_quantized_weights(user_weights,anime_weights)
+
             self.experiment.log_asset(MODEL_PATH)
             self.experiment.log_asset(ANIME_WEIGHTS_PATH)
             self.experiment.log_asset(USER_WEIGHTS_PATH)
@@ -134,6 +147,42 @@ class ModelTraining:
         except Exception as e:
             logger.error(str(e))
             raise CustomException("Error during saving model and weights Process",e)
+
+    def export_quantized_weights(self,user_weights,anime_weights):
+        try:
+            serving_config = read_yaml(CONFIG_PATH).get("serving",{})
+            dtypes = serving_config.get("quantization",[])
+            rescore_factor = serving_config.get("rescore_factor",4)
+
+            paths = {
+                "float16" : (USER_WEIGHTS_FLOAT16_PATH,ANIME_WEIGHTS_FLOAT16_PATH),
+                "int8" : (USER_WEIGHTS_INT8_PATH,ANIME_WEIGHTS_INT8_PATH),
+            }
+
+            report = {"user_weights" : [] , "anime_weights" : []}
+
+            for dtype in dtypes:
+                user_path,anime_path = paths[dtype]
+                save_quantized_embeddings(user_weights,user_path,dtype)
+                save_quantized_embeddings(anime_weights,anime_path,dtype)
+
+                for name,weights in [("user_weights",user_weights),("anime_weights",anime_weights)]:
+                    result = compare_quantization(weights,dtype,rescore_factor=rescore_factor)
+                    report[name].append(result)
+                    logger.info(f"{name} {dtype} quantization report : {result}")
+
+                    self.experiment.log_metrics(
+                        {key : value for key,value in result.items() if key != "dtype"},
+                        prefix=f"{name}_{dtype}"
+                    )
+
+            with open(QUANTIZATION_REPORT,"w") as f:
+                json.dump(report,f,indent=2)
+
+            logger.info("Quantized User and Anime weights saved sucesfully....")
+        except Exception as e:
+            logger.error(str(e))
+            raise CustomException("Error during quantized weights export",e)
         
 
 if __name__=="__main__":
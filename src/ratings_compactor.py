@@ -0,0 +1,198 @@
+import os
+import json
+import fcntl
+import shutil
+import threading
+import numpy as np
+from datetime import datetime
+from src.logger import get_logger
+from src.custom_exception import CustomException
+from src.serving_bundle import (ServingBundle,BUNDLE_FILES,MANIFEST_FILE,DELTA_LOG_FILE,VALIDATED_FILE,REJECTED_FILE,
+                                resolve_bundle_dir,write_current,prune_versions,mark_version,publish_lock,
+                                read_serving_config)
+from src.bundle_reloader import validate_bundle
+from src.ratings_delta import read_ratings,count_ratings,scale_ratings,drain_segments
+from config.paths_config import *
+
+### Runs inside the serving workers : NumPy only, no utils.common_functions (pandas)
+
+logger = get_logger(__name__)
+
+RATINGS_FILES = ("ratings_indptr","ratings_indices","ratings_values")
+### Held by the one process (of all pods sharing serving_dir) that compacts
+COMPACTOR_LOCK_FILE = ".compactor.lock"
+
+
+def try_lock(path):
+    """ File descriptor holding an exclusive lock on path, None when another process has it """
+    fd = os.open(path,os.O_RDWR | os.O_CREAT,0o644)
+    try:
+        fcntl.flock(fd,fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fd
+    except OSError:
+        os.close(fd)
+        return None
+
+
+def merge_ratings(indptr,indices,ratings,users,animes,new_ratings):
+    """
+    CSR ratings index with the (user, anime, rating) events merged in. Events
+    come after the index in time, so they replace an existing rating of the
+    same anime ; rows come out sorted by anime.
+    """
+    n_users = len(indptr) - 1
+    all_users = np.concatenate([np.repeat(np.arange(n_users),np.diff(indptr)),users])
+    all_animes = np.concatenate([indices,animes]).astype(np.int32)
+    all_ratings = np.concatenate([ratings,new_ratings]).astype(np.float32)
+
+    order = np.lexsort((np.arange(len(all_users)),all_animes,all_users))
+    all_users,all_animes,all_ratings = all_users[order],all_animes[order],all_ratings[order]
+
+    ### Last event of every (user, anime) pair wins
+    last = np.ones(len(all_users),dtype=bool)
+    last[:-1] = (all_users[1:] != all_users[:-1]) | (all_animes[1:] != all_animes[:-1])
+
+    merged_indptr = np.zeros(n_users + 1,dtype=np.int64)
+    np.cumsum(np.bincount(all_users[last],minlength=n_users),out=merged_indptr[1:])
+    return merged_indptr,all_animes[last],all_ratings[last]
+
+
+class RatingsCompactor:
+    """
+    Moves the pods' log segments into the delta log, then folds the rating
+    events appended to it into a new serving bundle version : same embeddings and catalog (hard links), a merged ratings index
+    and a manifest whose delta_offset skips the merged records. The version is
+    validated and published through CURRENT like any export, so workers pick it
+    up with their normal hot reload and are never blocked by the merge.
+    """
+    def __init__(self,serving_dir=SERVING_DIR,config_path=CONFIG_PATH):
+        self.serving_dir = serving_dir
+        self.config = read_serving_config(config_path)
+        compaction = self.config.get("compaction",{})
+        self.interval = compaction.get("interval",300)
+        self.min_records = compaction.get("min_records",1000)
+        self.delta_log = os.path.join(serving_dir,DELTA_LOG_FILE)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_fd = None
+
+    def _link(self,source_dir,output_dir,file_name):
+        try:
+            os.link(os.path.join(source_dir,file_name),os.path.join(output_dir,file_name))
+        except OSError:
+            shutil.copy2(os.path.join(source_dir,file_name),os.path.join(output_dir,file_name))
+
+    def compact(self):
+        """ New bundle version when enough events are pending, else None """
+        try:
+            ### Every pass, so segments stay small for the workers that read them per request
+            moved = drain_segments(self.delta_log)
+            if moved:
+                logger.debug("Moved %s rating events from the log segments", moved)
+
+            bundle_dir = resolve_bundle_dir(self.serving_dir)
+            if bundle_dir is None:
+                return None
+
+            bundle = ServingBundle(bundle_dir)
+            end = count_ratings(self.delta_log)
+            if end - bundle.delta_offset < max(self.min_records,1) or bundle.rating_scale is None:
+                return None
+
+            ### Segments of different pods interleave in the log : merge oldest event first
+            records = read_ratings(self.delta_log,bundle.delta_offset,end)
+            records = records[np.argsort(records["timestamp"],kind="stable")]
+            users = bundle.encode_users(records["user_id"])
+            animes = bundle.encode_animes(records["anime_id"])
+            known = (users >= 0) & (animes >= 0)
+            if not known.all():
+                ### No embedding to serve them with : they need a full retrain
+                logger.warning(f"{int((~known).sum())} rating events of unknown users / animes skipped")
+
+            indptr,indices,ratings = merge_ratings(
+                bundle.indptr,bundle.indices,bundle.ratings,
+                users[known],animes[known],scale_ratings(records["rating"][known],bundle.rating_scale),
+            )
+
+            version = datetime.now().strftime("%Y%m%d%H%M%S%f")
+            output_dir = os.path.join(self.serving_dir,version)
+            os.makedirs(output_dir,exist_ok=True)
+
+            skip = {BUNDLE_FILES[name] for name in RATINGS_FILES} | {MANIFEST_FILE,VALIDATED_FILE,REJECTED_FILE}
+            for file_name in os.listdir(bundle_dir):
+                if file_name not in skip and os.path.isfile(os.path.join(bundle_dir,file_name)):
+                    self._link(bundle_dir,output_dir,file_name)
+
+            for name,array in zip(RATINGS_FILES,(indptr,indices,ratings)):
+                np.save(os.path.join(output_dir,BUNDLE_FILES[name]),array)
+
+            manifest = dict(bundle.manifest)
+            manifest.update({
+                "version" : version,
+                "created_at" : datetime.now().isoformat(),
+                "compacted_from" : bundle.manifest.get("version"),
+                "delta_offset" : int(end),
+            })
+            manifest["files"] = {**manifest.get("files",{}),**{
+                BUNDLE_FILES[name] : os.path.getsize(os.path.join(output_dir,BUNDLE_FILES[name])) for name in RATINGS_FILES}}
+            with open(os.path.join(output_dir,MANIFEST_FILE),"w") as f:
+                json.dump(manifest,f,indent=2)
+
+            try:
+                validate_bundle(ServingBundle(output_dir))
+            except Exception:
+                shutil.rmtree(output_dir,ignore_errors=True)
+                raise
+            mark_version(output_dir,VALIDATED_FILE)
+
+            with publish_lock(self.serving_dir):
+                ### A retrained bundle published during the merge wins : its ratings
+                ### come from a newer rating_df and the log is replayed on top of it
+                published = resolve_bundle_dir(self.serving_dir)
+                if published is None or os.path.abspath(published) != os.path.abspath(bundle_dir):
+                    shutil.rmtree(output_dir,ignore_errors=True)
+                    logger.info(f"Compaction of {bundle.manifest.get('version')} dropped : {published} was published meanwhile")
+                    return None
+
+                write_current(self.serving_dir,version)
+                prune_versions(self.serving_dir,self.config.get("keep_versions",3))
+
+            logger.info(f"Compacted {end - bundle.delta_offset} rating events into serving bundle {version}")
+            return version
+        except Exception as e:
+            logger.error(f"Error while compacting rating events {e}")
+            raise CustomException("Failed to compact rating events",e)
+
+    def run(self):
+        ### Every worker runs this loop ; only the holder of the lock file compacts and
+        ### another one takes over when it exits (the OS drops the lock with the process)
+        while not self._stop.wait(self.interval):
+            if self._lock_fd is None:
+                if not os.path.isdir(self.serving_dir):
+                    continue
+                self._lock_fd = try_lock(os.path.join(self.serving_dir,COMPACTOR_LOCK_FILE))
+                if self._lock_fd is None:
+                    continue
+                logger.info(f"Ratings compactor running in process {os.getpid()}")
+
+            try:
+                self.compact()
+            except CustomException as e:
+                logger.error(str(e))
+
+    def start(self):
+        ### Started lazily in each worker process : threads do not survive a fork
+        if self.interval and self._thread is None:
+            self._thread = threading.Thread(target=self.run,name="ratings-compactor",daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+if __name__=="__main__":
+    ratings_compactor = RatingsCompactor()
+    ratings_compactor.run()
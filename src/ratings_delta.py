@@ -0,0 +1,248 @@
+import os
+import time
+import fcntl
+import socket
+import threading
+from datetime import datetime
+import numpy as np
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+### Rating events are written next to the serving bundles as fixed size binary
+### records, so readers index a file like an array. Pods share the volume over
+### NFS, where O_APPEND is not atomic across clients : every pod appends to its
+### own segment (ratings_delta.<hostname>.log) under flock, and the compactor
+### (one process of all pods) moves the segments into the delta log itself,
+### which therefore has a single writer and stable record offsets.
+### Ratings are stored raw ; they are scaled with the bundle's rating_scale on read.
+
+DELTA_MAGIC = 0x52415445
+
+DELTA_DTYPE = np.dtype([
+    ("magic" , "<u4"),
+    ("user_id" , "<i8"),
+    ("anime_id" , "<i8"),
+    ("rating" , "<f4"),
+    ("timestamp" , "<f8"),
+])
+
+ACTIVE_SUFFIX = ".log"
+SEALED_SUFFIX = ".sealed"
+
+
+def segment_path(delta_log,host=None):
+    """ Segment of delta_log this pod appends to """
+    root,_ = os.path.splitext(delta_log)
+    return f"{root}.{host or socket.gethostname()}{ACTIVE_SUFFIX}"
+
+
+def list_segments(delta_log):
+    """ Active and sealed segments next to delta_log, not yet moved into it """
+    log_dir = os.path.dirname(delta_log) or "."
+    prefix = os.path.splitext(os.path.basename(delta_log))[0] + "."
+    if not os.path.isdir(log_dir):
+        return []
+    return sorted(
+        os.path.join(log_dir,name) for name in os.listdir(log_dir)
+        if name.startswith(prefix) and name != os.path.basename(delta_log)
+        and name.endswith((ACTIVE_SUFFIX,SEALED_SUFFIX))
+    )
+
+
+def write_records(path,records):
+    """
+    Appends records under an exclusive flock. A torn last record left by a
+    crashed writer is overwritten, so it never shifts the records after it.
+    """
+    data = records.tobytes()
+    while True:
+        fd = os.open(path,os.O_WRONLY | os.O_CREAT,0o644)
+        try:
+            fcntl.flock(fd,fcntl.LOCK_EX)
+            ### The compactor renames segments it drains : only write into the file still at path
+            try:
+                current = os.stat(path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                current = False
+            if not current:
+                continue
+
+            size = os.fstat(fd).st_size
+            offset = size - size % DELTA_DTYPE.itemsize
+            written = 0
+            while written < len(data):
+                written += os.pwrite(fd,data[written:],offset + written)
+            return len(records)
+        finally:
+            os.close(fd)
+
+
+def append_ratings(path,user_ids,anime_ids,ratings,timestamps=None):
+    records = np.zeros(len(user_ids),dtype=DELTA_DTYPE)
+    records["magic"] = DELTA_MAGIC
+    records["user_id"] = user_ids
+    records["anime_id"] = anime_ids
+    records["rating"] = ratings
+    records["timestamp"] = time.time() if timestamps is None else timestamps
+    return write_records(path,records)
+
+
+def count_ratings(path):
+    try:
+        return os.path.getsize(path) // DELTA_DTYPE.itemsize
+    except FileNotFoundError:
+        return 0
+
+
+def read_ratings(path,start=0,stop=None):
+    """
+    Valid records among records start..stop of the file (complete records
+    only). Records that do not carry DELTA_MAGIC or have a non finite rating /
+    timestamp are torn or misaligned writes and are dropped.
+    """
+    stop = count_ratings(path) if stop is None else min(stop,count_ratings(path))
+    if stop <= start:
+        return np.empty(0,dtype=DELTA_DTYPE)
+
+    try:
+        records = np.fromfile(path,dtype=DELTA_DTYPE,count=stop - start,offset=start * DELTA_DTYPE.itemsize)
+    except FileNotFoundError:
+        return np.empty(0,dtype=DELTA_DTYPE)
+
+    valid = (records["magic"] == DELTA_MAGIC) & np.isfinite(records["rating"]) & np.isfinite(records["timestamp"])
+    if not valid.all():
+        logger.warning(f"{int((~valid).sum())} corrupt rating events skipped in {path}")
+    return records[valid]
+
+
+def read_pending_ratings(delta_log,start=0):
+    """ Records of delta_log from start plus every segment, oldest event first """
+    records = [read_ratings(delta_log,start)] + [read_ratings(path) for path in list_segments(delta_log)]
+    records = np.concatenate(records)
+    return records[np.argsort(records["timestamp"],kind="stable")]
+
+
+def drain_segments(delta_log):
+    """
+    Moves the records of every segment into delta_log and deletes the
+    segments ; the number of records moved. Only the compactor calls this.
+    A segment is renamed first, then locked : writers that opened it before
+    the rename finish their write, later ones create a new segment.
+    """
+    moved = 0
+    for path in list_segments(delta_log):
+        if path.endswith(ACTIVE_SUFFIX):
+            sealed = f"{os.path.splitext(path)[0]}.{datetime.now().strftime('%Y%m%d%H%M%S%f')}{SEALED_SUFFIX}"
+            try:
+                os.rename(path,sealed)
+            except FileNotFoundError:
+                continue
+            path = sealed
+
+        fd = os.open(path,os.O_RDONLY)
+        try:
+            fcntl.flock(fd,fcntl.LOCK_EX)
+            records = read_ratings(path)
+        finally:
+            os.close(fd)
+
+        ### A crash before the unlink moves the records again : readers keep the newest
+        ### event of every (user, anime), so a duplicate changes nothing
+        if len(records):
+            write_records(delta_log,records)
+        os.remove(path)
+        moved += len(records)
+    return moved
+
+
+def scale_ratings(ratings,rating_scale):
+    low,high = rating_scale
+    return ((np.asarray(ratings,dtype=np.float32) - low) / (high - low)).astype(np.float32)
+
+
+class DeltaOverlay:
+    """
+    Per user view of the log records a bundle has not merged yet (everything
+    after its delta_offset in the delta log, plus the segments), keyed by
+    encoded user / anime. refresh() only reads the records written since the
+    previous call ; the newest event of a (user, anime) wins, and events of
+    users or animes the bundle has no embedding for are skipped.
+    """
+    def __init__(self,path,start,encode_users,encode_animes,rating_scale):
+        self.path = path
+        self.position = start
+        self.encode_users = encode_users
+        self.encode_animes = encode_animes
+        self.rating_scale = rating_scale
+
+        ### Records read per segment, keyed by (path, inode) : a drained segment comes back under a new inode
+        self._segments = {}
+        self._ratings = {}
+        self._arrays = {}
+        self._lock = threading.Lock()
+
+    def _read_segments(self):
+        positions = {}
+        records = []
+        for path in list_segments(self.path):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            key = (path,stat.st_ino)
+            start,stop = self._segments.get(key,0),stat.st_size // DELTA_DTYPE.itemsize
+            if stop > start:
+                records.append(read_ratings(path,start,stop))
+            positions[key] = max(start,stop)
+        self._segments = positions
+        return records
+
+    def refresh(self):
+        with self._lock:
+            records = []
+            end = count_ratings(self.path)
+            if end > self.position:
+                records.append(read_ratings(self.path,self.position,end))
+                self.position = end
+                ### The compactor drained segments into the log : read what is left of them again
+                self._segments = {}
+            records += self._read_segments()
+            if not records:
+                return
+            records = np.concatenate(records)
+            if len(records) == 0:
+                return
+
+            users = self.encode_users(records["user_id"])
+            animes = self.encode_animes(records["anime_id"])
+            ratings = scale_ratings(records["rating"],self.rating_scale)
+            timestamps = records["timestamp"]
+
+            known = (users >= 0) & (animes >= 0)
+            for user,anime,rating,timestamp in zip(users[known].tolist(),animes[known].tolist(),
+                                                   ratings[known].tolist(),timestamps[known].tolist()):
+                user_ratings = self._ratings.setdefault(user,{})
+                if timestamp >= user_ratings.get(anime,(None,-np.inf))[1]:
+                    user_ratings[anime] = (rating,timestamp)
+                    self._arrays.pop(user,None)
+
+            logger.debug("Delta overlay read %s rating events (%s for known users / animes)", len(records), int(known.sum()))
+
+    def user_ratings(self,encoded_user):
+        """ (encoded animes, scaled ratings) of the user's unmerged events, None without any """
+        self.refresh()
+        arrays = self._arrays.get(encoded_user)
+        if arrays is None:
+            with self._lock:
+                ratings = self._ratings.get(encoded_user)
+                if not ratings:
+                    return None
+                arrays = (np.fromiter(ratings.keys(),dtype=np.int64,count=len(ratings)),
+                          np.fromiter((rating for rating , _ in ratings.values()),dtype=np.float32,count=len(ratings)))
+                self._arrays[encoded_user] = arrays
+        return arrays
+
+    @property
+    def size(self):
+        return sum(len(ratings) for ratings in self._ratings.values())
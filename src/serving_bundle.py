@@ -0,0 +1,467 @@
+import os
+import json
+import shutil
+import time
+import fcntl
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+from src.logger import get_logger
+from src.custom_exception import CustomException
+from utils.quantization import load_quantized_embeddings,quantized_top_k,SERVING_QUANTIZATION_DTYPES
+from utils.genres import genre_filter_mask
+from utils.title_search import TitleIndex
+from src.ratings_delta import DeltaOverlay
+
+logger = get_logger(__name__)
+
+### Serving only needs NumPy : keep pandas / joblib / tensorflow out of this module.
+
+BUNDLE_FILES = {
+    "user_embeddings" : "user_embeddings.npy",
+    "anime_embeddings" : "anime_embeddings.npy",
+    "user_ids" : "user_ids.npy",
+    "anime_ids" : "anime_ids.npy",
+    "anime_catalog_index" : "anime_catalog_index.npy",
+    "catalog" : "catalog.npz",
+    "ratings_indptr" : "ratings_indptr.npy",
+    "ratings_indices" : "ratings_indices.npy",
+    "ratings_values" : "ratings_values.npy",
+    "genre_bitsets" : "genre_bitsets.npy",
+    "content_embeddings" : "content_embeddings.npy",
+    "content_neighbors" : "content_neighbors.npz",
+    "catalog_genre_bitsets" : "catalog_genre_bitsets.npy",
+    "title_index" : "title_index.npz",
+}
+
+### Prefixes of the quantized tables, one .npy per part (see utils.quantization.quantized_paths)
+QUANTIZED_FILES = {
+    "user" : "user_embeddings_{dtype}",
+    "anime" : "anime_embeddings_{dtype}",
+}
+
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+### Serialises every CURRENT update (exporter, compactor, worker rollback)
+PUBLISH_LOCK_FILE = ".publish.lock"
+### Markers left in a version directory by the first process that validated it
+VALIDATED_FILE = "VALIDATED"
+REJECTED_FILE = "REJECTED"
+DELTA_LOG_FILE = "ratings_delta.log"
+
+
+class ServingBundle:
+    """
+    Read-only view over an exported serving bundle : embeddings, id maps,
+    anime catalog, the CSR ratings index, the synopsis content index and the
+    title search index (one row per catalog title, rated or not), all loaded
+    with NumPy. With a delta_log, rating events appended after the bundle was
+    built are read on top of the ratings index.
+    Embeddings and the ratings index are memory-mapped so every worker shares
+    the page cache and a reload does not double resident memory.
+    """
+
+    def __init__(self,bundle_dir,mmap=True,delta_log=None):
+        try:
+            start = time.perf_counter()
+            self.bundle_dir = bundle_dir
+
+            with open(os.path.join(bundle_dir,MANIFEST_FILE)) as f:
+                self.manifest = json.load(f)
+
+            mmap_mode = "r" if mmap else None
+            self.user_embeddings = np.load(self._path("user_embeddings"),mmap_mode=mmap_mode)
+            self.anime_embeddings = np.load(self._path("anime_embeddings"),mmap_mode=mmap_mode)
+            self.user_ids = np.load(self._path("user_ids"))
+            self.anime_ids = np.load(self._path("anime_ids"))
+            self.anime_catalog_index = np.load(self._path("anime_catalog_index"))
+
+            with np.load(self._path("catalog")) as catalog:
+                self.catalog_ids = catalog["anime_id"]
+                self.catalog_names = catalog["name"]
+                self.catalog_genres = catalog["genres"]
+
+            self.indptr = np.load(self._path("ratings_indptr"),mmap_mode=mmap_mode)
+            self.indices = np.load(self._path("ratings_indices"),mmap_mode=mmap_mode)
+            self.ratings = np.load(self._path("ratings_values"),mmap_mode=mmap_mode)
+
+            self.genre_bitsets = np.load(self._path("genre_bitsets"))
+            self.catalog_genre_bitsets = np.load(self._path("catalog_genre_bitsets"))
+            self.genres = self.manifest.get("genres",[])
+            self._genre_masks = {}
+
+            self.content_embeddings = np.load(self._path("content_embeddings"),mmap_mode=mmap_mode)
+            with np.load(self._path("content_neighbors")) as content_neighbors:
+                self.content_neighbors = content_neighbors["neighbors"]
+                self.content_scores = content_neighbors["scores"]
+            self.content_empty = ~np.any(self.content_embeddings,axis=1)
+
+            self.title_index = TitleIndex.load(self._path("title_index"))
+
+            self.quantization = self.manifest.get("quantization")
+            self.rescore_factor = self.manifest.get("rescore_factor",4)
+            self.quantized = {}
+            if self.quantization and self.quantization not in SERVING_QUANTIZATION_DTYPES:
+                raise ValueError(f"Bundle quantization {self.quantization} cannot be served, use one of {SERVING_QUANTIZATION_DTYPES}")
+            if self.quantization:
+                for table,file_name in QUANTIZED_FILES.items():
+                    path = os.path.join(bundle_dir,file_name.format(dtype=self.quantization))
+                    self.quantized[table] = load_quantized_embeddings(path,mmap_mode=mmap_mode)
+
+            ### Sorted id arrays replace the pickled encode dicts (searchsorted lookups)
+            self._user_order = np.argsort(self.user_ids,kind="stable")
+            self._anime_order = np.argsort(self.anime_ids,kind="stable")
+            self._catalog_order = np.argsort(self.catalog_ids,kind="stable")
+
+            ### Log records before delta_offset are already merged into the ratings index
+            self.rating_scale = self.manifest.get("rating_scale")
+            self.delta_offset = self.manifest.get("delta_offset",0)
+            self.deltas = None
+            if delta_log is not None and self.rating_scale is not None:
+                self.deltas = DeltaOverlay(delta_log,self.delta_offset,self.encode_users,self.encode_animes,self.rating_scale)
+
+            logger.info(f"Serving bundle {self.manifest.get('version')} loaded from {bundle_dir} in {time.perf_counter()-start:.3f}s")
+        except Exception as e:
+            logger.error(f"Error while loading serving bundle {e}")
+            raise CustomException("Failed to load serving bundle",e)
+
+    def _path(self,name):
+        return os.path.join(self.bundle_dir,BUNDLE_FILES[name])
+
+    @staticmethod
+    def _encode(ids,order,raw_id):
+        position = np.searchsorted(ids,raw_id,sorter=order)
+        if position < len(ids) and ids[order[position]] == raw_id:
+            return int(order[position])
+        return None
+
+    @staticmethod
+    def _encode_many(ids,order,raw_ids):
+        ### Vectorised _encode : -1 for unknown ids
+        raw_ids = np.asarray(raw_ids)
+        if len(ids) == 0:
+            return np.full(len(raw_ids),-1,dtype=np.int64)
+        positions = np.minimum(np.searchsorted(ids,raw_ids,sorter=order),len(ids) - 1)
+        return np.where(ids[order[positions]] == raw_ids,order[positions],-1)
+
+    def encode_user(self,user_id):
+        return self._encode(self.user_ids,self._user_order,user_id)
+
+    def encode_anime(self,anime_id):
+        return self._encode(self.anime_ids,self._anime_order,anime_id)
+
+    def encode_users(self,user_ids):
+        return self._encode_many(self.user_ids,self._user_order,user_ids)
+
+    def encode_animes(self,anime_ids):
+        return self._encode_many(self.anime_ids,self._anime_order,anime_ids)
+
+    def encode_catalog(self,anime_id):
+        return self._encode(self.catalog_ids,self._catalog_order,anime_id)
+
+    def search_titles(self,query,n=10,fuzzy=True):
+        """ Catalog rows and match scores for a (partial / misspelled) title """
+        results = self.title_index.search(query,n,fuzzy=fuzzy) if fuzzy else self.title_index.prefix(query,n)
+        rows = np.array([row for row , _ in results],dtype=np.int64)
+        return rows,np.array([score for _ , score in results],dtype=np.float32)
+
+    def anime_names(self,encoded_animes):
+        rows = self.anime_catalog_index[encoded_animes]
+        return np.where(rows >= 0,self.catalog_names[rows],"")
+
+    def anime_genres(self,encoded_animes):
+        rows = self.anime_catalog_index[encoded_animes]
+        return np.where(rows >= 0,self.catalog_genres[rows],"")
+
+    def genre_mask(self,include_genres=None,exclude_genres=None,catalog=False):
+        """
+        Encoded animes (catalog rows when catalog=True) having all include_genres
+        and none of exclude_genres, None without filters
+        """
+        key = (catalog,tuple(sorted(include_genres or ())),tuple(sorted(exclude_genres or ())))
+        mask = self._genre_masks.get(key)
+        if mask is None:
+            bitsets = self.catalog_genre_bitsets if catalog else self.genre_bitsets
+            mask = genre_filter_mask(bitsets,self.genres,include_genres,exclude_genres)
+            if len(self._genre_masks) < 256:
+                self._genre_masks[key] = mask
+        return mask
+
+    def _blocked(self,exclude,allowed):
+        ### Rows to drop before the top-k : explicit indices plus everything outside the genre mask
+        if allowed is None:
+            return exclude
+        blocked = ~allowed
+        if exclude is not None:
+            blocked[exclude] = True
+        return blocked
+
+    def user_ratings(self,encoded_user):
+        """ (encoded animes, scaled ratings) of the user : ratings index row plus unmerged rating events """
+        start,stop = self.indptr[encoded_user],self.indptr[encoded_user + 1]
+        animes,ratings = self.indices[start:stop],self.ratings[start:stop]
+
+        delta = self.deltas.user_ratings(encoded_user) if self.deltas is not None else None
+        if delta is None:
+            return animes,ratings
+
+        ### A new rating of an already rated anime replaces the old one
+        keep = ~np.isin(animes,delta[0])
+        return np.concatenate([animes[keep],delta[0]]),np.concatenate([ratings[keep],delta[1]])
+
+    def seen_animes(self,encoded_user):
+        return self.user_ratings(encoded_user)[0]
+
+    def _top_k(self,table,vector,k,exclude=None):
+        embeddings = self.user_embeddings if table == "user" else self.anime_embeddings
+
+        if table in self.quantized:
+            return quantized_top_k(self.quantized[table],vector,k,full_weights=embeddings,
+                                   rescore_factor=self.rescore_factor,exclude=exclude)
+
+        scores = np.dot(embeddings,vector)
+        if exclude is not None:
+            scores[exclude] = -np.inf
+
+        k = min(k,int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return np.empty(0,dtype=np.int64),np.empty(0,dtype=np.float32)
+
+        top = np.argpartition(-scores,k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top,scores[top]
+
+    def similar_users(self,user_id,n=10):
+        encoded_user = self.encode_user(user_id)
+        if encoded_user is None:
+            return np.empty(0,dtype=self.user_ids.dtype),np.empty(0,dtype=np.float32)
+
+        closest,similarity = self._top_k("user",self.user_embeddings[encoded_user],n,exclude=[encoded_user])
+        return self.user_ids[closest],similarity
+
+    def similar_animes(self,encoded_anime,n=10,include_genres=None,exclude_genres=None):
+        allowed = self.genre_mask(include_genres,exclude_genres)
+        return self._top_k("anime",self.anime_embeddings[encoded_anime],n,exclude=self._blocked([encoded_anime],allowed))
+
+    def similar_titles(self,catalog_row,n=10,include_genres=None,exclude_genres=None):
+        """
+        Catalog rows whose synopsis / genres are closest to catalog_row. Served
+        from the precomputed neighbour table ; a genre filter that leaves fewer
+        than n of those falls back to scoring the whole content table.
+        """
+        allowed = self.genre_mask(include_genres,exclude_genres,catalog=True)
+
+        neighbors = self.content_neighbors[catalog_row]
+        scores = self.content_scores[catalog_row]
+        keep = neighbors >= 0
+        if allowed is not None:
+            keep &= allowed[np.maximum(neighbors,0)]
+
+        ### A -1 in an unfiltered row means the table already lists every neighbour
+        if keep.sum() >= n or (allowed is None and not keep.all()):
+            return neighbors[keep][:n].astype(np.int64),scores[keep][:n]
+
+        if self.content_empty[catalog_row]:
+            return np.empty(0,dtype=np.int64),np.empty(0,dtype=np.float32)
+
+        scores = np.dot(self.content_embeddings,self.content_embeddings[catalog_row])
+        blocked = self.content_empty.copy()
+        if allowed is not None:
+            blocked |= ~allowed
+        blocked[catalog_row] = True
+        scores[blocked] = -np.inf
+
+        n = min(n,int(np.isfinite(scores).sum()))
+        if n <= 0:
+            return np.empty(0,dtype=np.int64),np.empty(0,dtype=np.float32)
+
+        top = np.argpartition(-scores,n - 1)[:n]
+        top = top[np.argsort(-scores[top])]
+        return top,scores[top]
+
+    def user_preferences(self,user_id):
+        """ Encoded animes the user rated at or above their own 75th percentile, best rated first """
+        encoded_user = self.encode_user(user_id)
+        if encoded_user is None:
+            return np.empty(0,dtype=self.indices.dtype)
+
+        animes,ratings = self.user_ratings(encoded_user)
+        if len(ratings) == 0:
+            return np.empty(0,dtype=self.indices.dtype)
+
+        keep = ratings >= np.percentile(ratings,75)
+        order = np.argsort(-ratings[keep],kind="stable")
+        return animes[keep][order]
+
+    def user_recommendations(self,similar_user_ids,user_pref,n=10,include_genres=None,exclude_genres=None):
+        """ Animes most often preferred by the similar users and not already preferred by the user """
+        counts = np.zeros(len(self.anime_ids),dtype=np.int64)
+        for similar_user in similar_user_ids:
+            counts[self.user_preferences(int(similar_user))] += 1
+
+        counts[user_pref] = 0
+        counts[self.anime_catalog_index < 0] = 0
+
+        allowed = self.genre_mask(include_genres,exclude_genres)
+        if allowed is not None:
+            counts[~allowed] = 0
+
+        candidates = np.flatnonzero(counts)
+        order = np.argsort(-counts[candidates],kind="stable")[:n]
+        return candidates[order],counts[candidates[order]]
+
+    def recommend_for_user(self,user_id,n=10,exclude_seen=True,include_genres=None,exclude_genres=None):
+        encoded_user = self.encode_user(user_id)
+        if encoded_user is None:
+            return np.empty(0,dtype=np.int64),np.empty(0,dtype=np.float32)
+
+        exclude = self.seen_animes(encoded_user) if exclude_seen else None
+        allowed = self.genre_mask(include_genres,exclude_genres)
+        return self._top_k("anime",self.user_embeddings[encoded_user],n,exclude=self._blocked(exclude,allowed))
+
+
+def resolve_bundle_dir(serving_dir):
+    """
+    Bundle directory to serve from serving_dir : the version named in CURRENT,
+    else serving_dir itself when it holds a manifest, else the newest version
+    directory that has one. None when nothing has been exported yet.
+    """
+    current_file = os.path.join(serving_dir,CURRENT_FILE)
+    if os.path.exists(current_file):
+        with open(current_file) as f:
+            bundle_dir = os.path.join(serving_dir,f.read().strip())
+        if os.path.exists(os.path.join(bundle_dir,MANIFEST_FILE)):
+            return bundle_dir
+
+    if os.path.exists(os.path.join(serving_dir,MANIFEST_FILE)):
+        return serving_dir
+
+    if not os.path.isdir(serving_dir):
+        return None
+
+    versions = list_versions(serving_dir)
+    return os.path.join(serving_dir,versions[-1]) if versions else None
+
+
+def list_versions(serving_dir):
+    return sorted(
+        name for name in os.listdir(serving_dir)
+        if os.path.exists(os.path.join(serving_dir,name,MANIFEST_FILE))
+    )
+
+
+def bundle_exists(serving_dir):
+    return resolve_bundle_dir(serving_dir) is not None
+
+
+def write_current(serving_dir,version):
+    ### Write-then-rename so readers never see a half written pointer ; the temp
+    ### name is unique because pods sharing the volume may publish concurrently
+    fd,tmp_file = tempfile.mkstemp(prefix=f".{CURRENT_FILE}.",dir=serving_dir)
+    with os.fdopen(fd,"w") as f:
+        f.write(version)
+    os.replace(tmp_file,os.path.join(serving_dir,CURRENT_FILE))
+
+
+def read_serving_config(config_path):
+    ### pyyaml is part of the serving requirements ; imported lazily like the rest of the serving path
+    import yaml
+    with open(config_path) as f:
+        return (yaml.safe_load(f) or {}).get("serving",{})
+
+
+@contextmanager
+def publish_lock(serving_dir):
+    """
+    Exclusive lock around a read-check-write of CURRENT, shared by every
+    process publishing into serving_dir. Re-read CURRENT inside it : a
+    publisher holding an older view must not overwrite a newer version.
+    """
+    os.makedirs(serving_dir,exist_ok=True)
+    fd = os.open(os.path.join(serving_dir,PUBLISH_LOCK_FILE),os.O_RDWR | os.O_CREAT,0o644)
+    try:
+        fcntl.flock(fd,fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def seed_serving_dir(seed_dir,serving_dir,keep_versions=None):
+    """
+    Publishes the bundle baked into the image (the version CURRENT names in
+    seed_dir) when it is newer than the version published in serving_dir, so
+    every image rollout ships its model, also onto a volume that already holds
+    bundles. The version is copied under a temporary name and renamed into
+    place (replicas seeding at once never see a partial bundle, the first
+    rename wins) ; CURRENT moves under publish_lock. A version the workers
+    rejected is never published again. Returns the published version.
+    """
+    seed_bundle = resolve_bundle_dir(seed_dir) if os.path.isdir(seed_dir) else None
+    if seed_bundle is None or os.path.abspath(seed_bundle) == os.path.abspath(seed_dir):
+        return None
+
+    version = os.path.basename(os.path.normpath(seed_bundle))
+    os.makedirs(serving_dir,exist_ok=True)
+    if has_marker(serving_dir,version,REJECTED_FILE):
+        return None
+
+    if not os.path.exists(os.path.join(serving_dir,version,MANIFEST_FILE)):
+        tmp_dir = tempfile.mkdtemp(prefix=f".{version}.",dir=serving_dir)
+        shutil.copytree(seed_bundle,tmp_dir,dirs_exist_ok=True)
+        try:
+            os.rename(tmp_dir,os.path.join(serving_dir,version))
+        except OSError:
+            shutil.rmtree(tmp_dir,ignore_errors=True)
+
+    with publish_lock(serving_dir):
+        ### Version names are timestamps : a retrain published after this image was built wins
+        published = resolve_bundle_dir(serving_dir) if os.path.exists(os.path.join(serving_dir,CURRENT_FILE)) else None
+        if published is not None and os.path.basename(os.path.normpath(published)) >= version:
+            return None
+
+        write_current(serving_dir,version)
+        if keep_versions:
+            prune_versions(serving_dir,keep_versions)
+
+    logger.info(f"Serving bundle {version} of the image published to {serving_dir}")
+    return version
+
+
+def mark_version(bundle_dir,marker):
+    try:
+        with open(os.path.join(bundle_dir,marker),"w") as f:
+            f.write(time.strftime("%Y-%m-%dT%H:%M:%S"))
+    except OSError as e:
+        logger.warning(f"Could not mark {bundle_dir} {marker} : {e}")
+
+
+def has_marker(serving_dir,version,marker):
+    return os.path.exists(os.path.join(serving_dir,version,marker))
+
+
+def prune_versions(serving_dir,keep_versions):
+    """
+    Removes old versions, keeping the one CURRENT names and the newest
+    keep_versions that passed validation. Rejected versions never count toward
+    keep_versions and are removed ; versions nobody has validated yet are kept
+    while newer than the last validated one (workers may still be loading them).
+    """
+    ### Older versions stay on disk for rollback ; mapped files survive deletion on POSIX
+    versions = list_versions(serving_dir)
+    validated = [version for version in versions if has_marker(serving_dir,version,VALIDATED_FILE)]
+
+    keep = set(validated[-max(keep_versions,1):])
+    current = resolve_bundle_dir(serving_dir)
+    if current is not None:
+        keep.add(os.path.basename(os.path.normpath(current)))
+
+    removed = []
+    for version in versions:
+        if version in keep:
+            continue
+        pending = not has_marker(serving_dir,version,REJECTED_FILE) and not has_marker(serving_dir,version,VALIDATED_FILE)
+        if pending and (not validated or version > validated[-1]):
+            continue
+        shutil.rmtree(os.path.join(serving_dir,version),ignore_errors=True)
+        removed.append(version)
+    return removed
@@ -0,0 +1,42 @@
+import numpy as np
+from src.ratings_compactor import merge_ratings
+
+
+def ratings_index():
+    ### user 0 rated animes 1 and 3, user 1 has no rating, user 2 rated anime 0
+    indptr = np.array([0,2,2,3],dtype=np.int64)
+    indices = np.array([1,3,0],dtype=np.int32)
+    ratings = np.array([0.5,0.7,0.9],dtype=np.float32)
+    return indptr,indices,ratings
+
+
+def rows(indptr,indices,ratings):
+    return [dict(zip(indices[start:stop].tolist(),ratings[start:stop].tolist()))
+            for start,stop in zip(indptr[:-1],indptr[1:])]
+
+
+def test_event_replaces_existing_rating():
+    merged = merge_ratings(*ratings_index(),np.array([0]),np.array([3]),np.array([0.1],dtype=np.float32))
+    assert rows(*merged) == [{1 : 0.5,3 : np.float32(0.1)},{},{0 : np.float32(0.9)}]
+
+
+def test_last_event_of_a_pair_wins():
+    merged = merge_ratings(*ratings_index(),np.array([2,2]),np.array([0,0]),np.array([0.2,0.3],dtype=np.float32))
+    assert rows(*merged)[2] == {0 : np.float32(0.3)}
+
+
+def test_new_anime_is_inserted_in_anime_order():
+    indptr,indices,ratings = merge_ratings(*ratings_index(),np.array([0]),np.array([2]),np.array([0.4],dtype=np.float32))
+    assert indptr.tolist() == [0,3,3,4]
+    assert indices[:3].tolist() == [1,2,3]
+    assert ratings[:3].tolist() == np.array([0.5,0.4,0.7],dtype=np.float32).tolist()
+
+
+def test_empty_user_row():
+    merged = merge_ratings(*ratings_index(),np.array([1]),np.array([4]),np.array([0.6],dtype=np.float32))
+    assert rows(*merged)[1] == {4 : np.float32(0.6)}
+
+    ### Without events the empty row stays empty
+    indptr,indices,ratings = merge_ratings(*ratings_index(),np.empty(0,dtype=np.int64),np.empty(0,dtype=np.int64),np.empty(0,dtype=np.float32))
+    assert indptr.tolist() == [0,2,2,3]
+    assert rows(indptr,indices,ratings) == rows(*ratings_index())
@@ -0,0 +1,50 @@
+import os
+from src.serving_bundle import (MANIFEST_FILE,VALIDATED_FILE,REJECTED_FILE,list_versions,mark_version,
+                                prune_versions,write_current)
+
+
+def make_version(serving_dir,version,marker=None):
+    version_dir = os.path.join(serving_dir,version)
+    os.makedirs(version_dir)
+    with open(os.path.join(version_dir,MANIFEST_FILE),"w") as f:
+        f.write("{}")
+    if marker is not None:
+        mark_version(version_dir,marker)
+
+
+def test_prune_versions(tmp_path):
+    serving_dir = str(tmp_path)
+    make_version(serving_dir,"v1",VALIDATED_FILE)
+    make_version(serving_dir,"v2",REJECTED_FILE)
+    make_version(serving_dir,"v3")
+    make_version(serving_dir,"v4",VALIDATED_FILE)
+    make_version(serving_dir,"v5",VALIDATED_FILE)
+    make_version(serving_dir,"v6")
+    ### Rolled back to an old version
+    write_current(serving_dir,"v1")
+
+    removed = prune_versions(serving_dir,keep_versions=1)
+
+    ### CURRENT, the newest validated version and a pending export newer than it survive
+    assert removed == ["v2","v3","v4"]
+    assert list_versions(serving_dir) == ["v1","v5","v6"]
+
+
+def test_prune_versions_keeps_pending_without_validated(tmp_path):
+    serving_dir = str(tmp_path)
+    make_version(serving_dir,"v1",REJECTED_FILE)
+    make_version(serving_dir,"v2")
+    make_version(serving_dir,"v3")
+
+    assert prune_versions(serving_dir,keep_versions=3) == ["v1"]
+    assert list_versions(serving_dir) == ["v2","v3"]
+
+
+def test_prune_versions_keeps_at_least_one_validated(tmp_path):
+    serving_dir = str(tmp_path)
+    for version in ("v1","v2","v3"):
+        make_version(serving_dir,version,VALIDATED_FILE)
+    write_current(serving_dir,"v3")
+
+    assert prune_versions(serving_dir,keep_versions=0) == ["v1","v2"]
+    assert list_versions(serving_dir) == ["v3"]
@@ -3,6 +3,7 @@ import pandas
 from src.logger import get_logger
 from src.custom_exception import CustomException
 import yaml
+import numpy as np
 import pandas as pd
 
 logger = get_logger(__name__)
@@ -19,4 +20,27 @@ def read_yaml(file_path):
     
     except Exception as e:
         logger.error("Error while reading YAML file")
-        raise CustomException("Failed to read YAMl file" , e)
\ No newline at end of file
+        raise CustomException("Failed to read YAMl file" , e)
+
+
+SPLIT_COLUMNS = {"user" : "int32" , "anime" : "int32" , "rating" : "float32"}
+
+def save_split(split_dir, split, arrays):
+    try:
+        os.makedirs(split_dir, exist_ok=True)
+        for column, dtype in SPLIT_COLUMNS.items():
+            np.save(os.path.join(split_dir, f"{split}_{column}.npy"), np.asarray(arrays[column], dtype=dtype))
+        logger.info(f"{split} split saved to {split_dir}")
+    except Exception as e:
+        logger.error(f"Error while saving {split} split")
+        raise CustomException(f"Failed to save {split} split", e)
+
+def load_split(split_dir, split, mmap_mode="r"):
+    try:
+        return {
+            column : np.load(os.path.join(split_dir, f"{split}_{column}.npy"), mmap_mode=mmap_mode)
+            for column in SPLIT_COLUMNS
+        }
+    except Exception as e:
+        logger.error(f"Error while loading {split} split")
+        raise CustomException(f"Failed to load {split} split", e)
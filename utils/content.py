@@ -0,0 +1,123 @@
+import re
+import numpy as np
+from collections import Counter
+from scipy import sparse
+from scipy.sparse.linalg import svds
+from utils.genres import parse_genres,build_genre_vocab
+
+### Content embeddings : TF-IDF over synopsis words + genres, reduced with a
+### truncated SVD to a small dense table whose rows are L2-normalised, so a dot
+### product is the cosine similarity exactly like the learned embeddings.
+### Everything here runs offline ; serving only reads the resulting arrays.
+
+TOKEN_PATTERN = re.compile(r"[a-z][a-z']+")
+
+
+def tokenize(text):
+    if not isinstance(text, str):
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def build_tfidf(texts, genre_strings, min_df=2, max_df=0.5, max_features=20000, genre_weight=2.0):
+    """
+    Sparse CSR TF-IDF matrix with one row per document. Words seen in fewer than
+    min_df documents or in more than max_df of them are dropped ; every genre is
+    an extra term whose tf is genre_weight so genres still count for titles with
+    a short synopsis.
+    """
+    documents = [Counter(tokenize(text)) for text in texts]
+    n_docs = len(documents)
+
+    document_frequency = Counter(word for counts in documents for word in counts)
+    max_count = max_df * n_docs
+    words = [word for word, df in document_frequency.items() if min_df <= df <= max_count]
+    words = sorted(words, key=lambda word: (-document_frequency[word], word))[:max_features]
+    vocab = {word: i for i, word in enumerate(sorted(words))}
+
+    genres = build_genre_vocab(genre_strings)
+    offset = len(vocab)
+    vocab.update({f"genre:{genre}": offset + i for i, genre in enumerate(genres)})
+    genre_position = {genre: offset + i for i, genre in enumerate(genres)}
+
+    indptr, indices, values = [0], [], []
+    for counts, genre_string in zip(documents, genre_strings):
+        row = {vocab[word]: 1.0 + np.log(count) for word, count in counts.items() if word in vocab}
+        for genre in parse_genres(genre_string):
+            if genre in genre_position:
+                row[genre_position[genre]] = genre_weight
+        indices.extend(row.keys())
+        values.extend(row.values())
+        indptr.append(len(indices))
+
+    tf = sparse.csr_matrix(
+        (np.asarray(values, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+        shape=(n_docs, len(vocab)),
+    )
+
+    ### Smoothed idf, then unit rows so long synopses do not dominate
+    df = np.bincount(tf.indices, minlength=tf.shape[1])
+    idf = (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+    tfidf = tf @ sparse.diags(idf)
+    return normalize_rows(tfidf), vocab
+
+
+def normalize_rows(matrix):
+    if sparse.issparse(matrix):
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.csr_matrix(sparse.diags(1.0 / norms) @ matrix, dtype=np.float32)
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def reduce_dimensions(tfidf, dimensions=128, random_state=43):
+    """ Truncated SVD of the sparse TF-IDF matrix to a dense (n_docs, dimensions) table """
+    dimensions = min(dimensions, min(tfidf.shape) - 1)
+    if dimensions < 1:
+        return np.zeros((tfidf.shape[0], 1), dtype=np.float32)
+
+    v0 = np.random.default_rng(random_state).uniform(-1, 1, min(tfidf.shape))
+    u, s, _ = svds(tfidf.astype(np.float64), k=dimensions, v0=v0)
+    order = np.argsort(-s)
+    embeddings = normalize_rows(u[:, order] * s[order])
+
+    ### Documents without any kept term stay exact zero vectors (no neighbours)
+    embeddings[np.diff(tfidf.indptr) == 0] = 0
+    return embeddings
+
+
+def build_neighbor_index(embeddings, k=50, block_size=2048):
+    """
+    Top-k most similar rows of every row (itself excluded), computed in blocks of
+    one matrix multiplication each. Rows without any content (zero vector) get
+    no neighbours : their entries are -1 with a score of 0.
+    """
+    n_rows = len(embeddings)
+    k = min(k, n_rows - 1)
+    neighbors = np.full((n_rows, max(k, 0)), -1, dtype=np.int32)
+    scores = np.zeros((n_rows, max(k, 0)), dtype=np.float32)
+    if k <= 0:
+        return neighbors, scores
+
+    empty = ~np.any(embeddings, axis=1)
+
+    for start in range(0, n_rows, block_size):
+        stop = min(start + block_size, n_rows)
+        block = np.dot(embeddings[start:stop], embeddings.T)
+        block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        block[:, empty] = -np.inf
+
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        valid = np.isfinite(top_scores) & ~empty[start:stop, None]
+        neighbors[start:stop] = np.where(valid, top, -1)
+        scores[start:stop] = np.where(valid, top_scores, 0)
+
+    return neighbors, scores
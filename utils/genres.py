@@ -0,0 +1,61 @@
+import numpy as np
+
+### Genres live as "Action, Comedy, ..." strings in anime_df.csv. They are parsed once
+### at processing time into one bit per genre (uint64 words per anime) so that genre
+### filters become a couple of vectorized AND / compare ops over the catalog.
+
+def parse_genres(genres):
+    if not isinstance(genres, str):
+        return []
+    return [genre.strip() for genre in genres.split(",") if genre.strip() and genre.strip() != "Unknown"]
+
+
+def build_genre_vocab(genre_strings):
+    return sorted({genre for genres in genre_strings for genre in parse_genres(genres)})
+
+
+def build_genre_bitsets(genre_strings, vocab):
+    position = {genre: i for i, genre in enumerate(vocab)}
+    n_words = max(1, (len(vocab) + 63) // 64)
+    bitsets = np.zeros((len(genre_strings), n_words), dtype=np.uint64)
+
+    for row, genres in enumerate(genre_strings):
+        for genre in parse_genres(genres):
+            bit = position.get(genre)
+            if bit is not None:
+                bitsets[row, bit // 64] |= np.uint64(1) << np.uint64(bit % 64)
+    return bitsets
+
+
+def genre_bits(vocab, genres, n_words):
+    position = {genre: i for i, genre in enumerate(vocab)}
+    bits = np.zeros(n_words, dtype=np.uint64)
+
+    for genre in genres:
+        if genre not in position:
+            raise ValueError(f"Unknown genre : {genre}")
+        bit = position[genre]
+        bits[bit // 64] |= np.uint64(1) << np.uint64(bit % 64)
+    return bits
+
+
+def genre_filter_mask(bitsets, vocab, include_genres=None, exclude_genres=None):
+    """
+    Boolean mask over the rows of bitsets : rows having every genre in
+    include_genres and none of exclude_genres. None when there is no filter.
+    """
+    if not include_genres and not exclude_genres:
+        return None
+
+    mask = np.ones(len(bitsets), dtype=bool)
+    n_words = bitsets.shape[1]
+
+    if include_genres:
+        include = genre_bits(vocab, include_genres, n_words)
+        mask &= ((bitsets & include) == include).all(axis=1)
+
+    if exclude_genres:
+        exclude = genre_bits(vocab, exclude_genres, n_words)
+        mask &= ((bitsets & exclude) == 0).all(axis=1)
+
+    return mask
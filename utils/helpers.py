@@ -1,64 +1,102 @@
 import pandas as pd
 import numpy as np
 import joblib
+import os
+import json
+from src.logger import get_logger
+from utils.genres import genre_filter_mask
+from utils.title_search import TitleIndex
+from src.ratings_delta import DELTA_DTYPE, read_pending_ratings, scale_ratings
 from config.paths_config import *
 
+logger = get_logger(__name__)
+
 ############# 1. GET_ANIME_FRAME
 
 def getAnimeFrame(anime,path_df):
-    print(f"[getAnimeFrame] Called with anime={anime}")
+    logger.debug("[getAnimeFrame] Called with anime=%s", anime)
     df = pd.read_csv(path_df)
     if isinstance(anime,int):
-        print(f"[getAnimeFrame] Searching by anime_id={anime}")
+        logger.debug("[getAnimeFrame] Searching by anime_id=%s", anime)
         return df[df.anime_id == anime]
     if isinstance(anime,str):
-        print(f"[getAnimeFrame] Searching by eng_version='{anime}'")
-        return df[df.eng_version == anime]
+        logger.debug("[getAnimeFrame] Searching by eng_version='%s'", anime)
+        frame = df[df.eng_version == anime]
+        if frame.empty and os.path.exists(TITLE_INDEX):
+            # Misspelled / partial / original title : best match of the title index (rows are anime_df rows)
+            results = TitleIndex.load(TITLE_INDEX).search(anime, n=1)
+            if results:
+                logger.debug("[getAnimeFrame] '%s' resolved to '%s'", anime, df.eng_version.values[results[0][0]])
+                frame = df.iloc[[results[0][0]]]
+        return frame
     
 
 ########## 2. GET_SYNOPSIS
 
 def getSynopsis(anime,path_synopsis_df):
-    print(f"[getSynopsis] Called with anime={anime}")
+    logger.debug("[getSynopsis] Called with anime=%s", anime)
     synopsis_df = pd.read_csv(path_synopsis_df)
     if isinstance(anime,int):
-        print(f"[getSynopsis] Searching by MAL_ID={anime}")
+        logger.debug("[getSynopsis] Searching by MAL_ID=%s", anime)
         return synopsis_df[synopsis_df.MAL_ID == anime].sypnopsis.values[0]
     if isinstance(anime,str):
-        print(f"[getSynopsis] Searching by Name='{anime}'")
+        logger.debug("[getSynopsis] Searching by Name='%s'", anime)
         return synopsis_df[synopsis_df.Name == anime].sypnopsis.values[0]
 
 
 ########## 3. CONTENT RECOMMENDATION
 
-def find_similar_animes(name, path_anime_weights, path_anime2anime_encoded, path_anime2anime_decoded, path_anime_df, n=10, return_dist=False, neg=False):
-    print(f"[find_similar_animes] Called with name='{name}', n={n}, return_dist={return_dist}, neg={neg}")
+def get_genre_mask(include_genres=None, exclude_genres=None, path_genre_bitsets=GENRE_BITSETS, path_genre_vocab=GENRE_VOCAB):
+    if not include_genres and not exclude_genres:
+        return None
+    with open(path_genre_vocab) as f:
+        vocab = json.load(f)
+    return genre_filter_mask(np.load(path_genre_bitsets), vocab, include_genres, exclude_genres)
+
+
+def find_similar_animes(name, path_anime_weights, path_anime2anime_encoded, path_anime2anime_decoded, path_anime_df, n=10, return_dist=False, neg=False, include_genres=None, exclude_genres=None):
+    logger.debug("[find_similar_animes] Called with name='%s', n=%s, return_dist=%s, neg=%s, include_genres=%s, exclude_genres=%s", name, n, return_dist, neg, include_genres, exclude_genres)
     anime_weights = joblib.load(path_anime_weights)
     anime2anime_encoded = joblib.load(path_anime2anime_encoded)
     anime2anime_decoded = joblib.load(path_anime2anime_decoded)
 
-    index = getAnimeFrame(name, path_anime_df).anime_id.values[0]
-    print(f"[find_similar_animes] Anime ID resolved: {index}")
+    frame = getAnimeFrame(name, path_anime_df)
+    if frame.empty:
+        raise ValueError(f"Unknown anime : {name}")
+    index = frame.anime_id.values[0]
+    logger.debug("[find_similar_animes] Anime ID resolved: %s", index)
     encoded_index = anime2anime_encoded.get(index)
 
     if encoded_index is None:
-        print("[find_similar_animes] Encoded index not found!")
-        raise ValueError(f"Encoded index not found for anime ID: {index}")
+        if return_dist or neg:
+            logger.warning("[find_similar_animes] Encoded index not found!")
+            raise ValueError(f"Encoded index not found for anime ID: {index}")
+        # Nobody rated this title : its synopsis is all we have
+        logger.debug("[find_similar_animes] anime ID %s has no embedding, using synopsis similarity", index)
+        return find_similar_titles(int(index), CONTENT_INDEX, path_anime_df, n=n, include_genres=include_genres, exclude_genres=exclude_genres)
 
     dists = np.dot(anime_weights, anime_weights[encoded_index])
+
+    allowed = get_genre_mask(include_genres, exclude_genres)
+    if allowed is not None:
+        # The query itself stays in so it is dropped from the frame below as usual
+        allowed[encoded_index] = True
+        dists = np.where(allowed, dists, np.inf if neg else -np.inf)
+        n = min(n, int(allowed.sum()) - 1)
+
     sorted_dists = np.argsort(dists)
 
     n = n + 1
 
     if neg:
-        print("[find_similar_animes] Getting least similar animes")
+        logger.debug("[find_similar_animes] Getting least similar animes")
         closest = sorted_dists[:n]
     else:
-        print("[find_similar_animes] Getting most similar animes")
+        logger.debug("[find_similar_animes] Getting most similar animes")
         closest = sorted_dists[-n:]
 
     if return_dist:
-        print("[find_similar_animes] Returning raw distances and indices")
+        logger.debug("[find_similar_animes] Returning raw distances and indices")
         return dists, closest
 
     SimilarityArr = []
@@ -77,10 +115,52 @@ def find_similar_animes(name, path_anime_weights, path_anime2anime_encoded, path
         })
 
     Frame = pd.DataFrame(SimilarityArr).sort_values(by="similarity", ascending=False)
-    print("[find_similar_animes] Recommendation frame constructed")
+    logger.debug("[find_similar_animes] Recommendation frame constructed")
     return Frame[Frame.anime_id != index].drop(['anime_id'], axis=1)
 
 
+def find_similar_titles(name, path_content_index, path_anime_df, n=10, include_genres=None, exclude_genres=None):
+    """
+    Content-based neighbours from the synopsis TF-IDF index. Covers every
+    catalog title, including the ones that are not in anime2anime_encoded.
+    """
+    logger.debug("[find_similar_titles] Called with name='%s', n=%s", name, n)
+    content_index = np.load(path_content_index)
+    df = pd.read_csv(path_anime_df)
+
+    frame = getAnimeFrame(name, path_anime_df)
+    if frame.empty:
+        raise ValueError(f"Unknown anime : {name}")
+    anime_id = frame.anime_id.values[0]
+    row = int(np.flatnonzero(content_index["anime_id"] == anime_id)[0])
+
+    embeddings = content_index["embeddings"]
+    scores = np.dot(embeddings, embeddings[row])
+    scores[~np.any(embeddings, axis=1)] = -np.inf
+    scores[row] = -np.inf
+
+    if include_genres or exclude_genres:
+        with open(GENRE_VOCAB) as f:
+            vocab = json.load(f)
+        scores[~genre_filter_mask(content_index["genre_bitsets"], vocab, include_genres, exclude_genres)] = -np.inf
+
+    n = min(n, int(np.isfinite(scores).sum()))
+    if n <= 0 or not np.any(embeddings[row]):
+        return pd.DataFrame(columns=["name", "similarity", "genre"])
+
+    top = np.argpartition(-scores, n - 1)[:n]
+    top = top[np.argsort(-scores[top])]
+
+    # Content rows are anime_df.csv rows
+    frame = pd.DataFrame({
+        "name": df.eng_version.values[top],
+        "similarity": scores[top],
+        "genre": df.Genres.values[top],
+    })
+    logger.debug("[find_similar_titles] Recommendation frame constructed")
+    return frame
+
+
 ######## 4. FIND_SIMILAR_USERS
 
 # def find_similar_users(item_input , path_user_weights , path_user2user_encoded , path_user2user_decoded, n=10 , return_dist=False,neg=False):
@@ -129,7 +209,7 @@ def find_similar_users(item_input, path_user_weights, path_user2user_encoded, pa
     """
     Finds users similar to a given user based on interaction embeddings.
     """
-    print(f"[find_similar_users] Called with user_id={item_input}, n={n}, return_dist={return_dist}, neg={neg}")
+    logger.debug("[find_similar_users] Called with user_id=%s, n=%s, return_dist=%s, neg=%s", item_input, n, return_dist, neg)
     
     try:
         # Load data
@@ -137,13 +217,10 @@ def find_similar_users(item_input, path_user_weights, path_user2user_encoded, pa
         user2user_encoded = joblib.load(path_user2user_encoded)
         user2user_decoded = joblib.load(path_user2user_decoded)
 
-        valid_users = list(user2user_encoded.keys())
-        print(f"[Valid Users] Total: {len(valid_users)}\nUser IDs: {valid_users}")
-
         # Get encoded index of input user
         encoded_index = user2user_encoded.get(item_input)
         if encoded_index is None:
-            print(f"[find_similar_users] Encoded index not found for user_id={item_input}")
+            logger.warning("[find_similar_users] Encoded index not found for user_id=%s", item_input)
             return pd.DataFrame(columns=["similar_users", "similarity"])
 
         # Get target embedding vector and squeeze to ensure correct shape
@@ -179,22 +256,50 @@ def find_similar_users(item_input, path_user_weights, path_user2user_encoded, pa
                 })
 
         similar_users_df = pd.DataFrame(SimilarityArr).sort_values(by="similarity", ascending=False)
-        print(f"[find_similar_users] Found {len(similar_users_df)} similar users")
+        logger.debug("[find_similar_users] Found %s similar users", len(similar_users_df))
         return similar_users_df
 
     except Exception as e:
-        print(f"[find_similar_users] Error occurred: {e}")
+        logger.error("[find_similar_users] Error occurred: %s", e)
         return pd.DataFrame(columns=["similar_users", "similarity"])
 
 
 ################## 5. GET USER PREF
 
-def get_user_preferences(user_id , path_rating_df , path_anime_df ):
-    print(f"[get_user_preferences] Called with user_id={user_id}")
+def load_rating_deltas(path_delta_log=RATINGS_DELTA_LOG, path_ratings_index=RATINGS_INDEX):
+    """
+    Rating events logged since rating_df was written (delta log and the pods'
+    segments), oldest first, ratings scaled like rating_df. Read once per
+    request and passed to the helpers below.
+    """
+    if not os.path.exists(path_ratings_index):
+        return np.empty(0, dtype=DELTA_DTYPE)
+
+    deltas = read_pending_ratings(path_delta_log)
+    if len(deltas):
+        with np.load(path_ratings_index) as ratings_index:
+            deltas["rating"] = scale_ratings(deltas["rating"], ratings_index["rating_scale"])
+    return deltas
+
+
+def get_user_preferences(user_id , path_rating_df , path_anime_df , deltas=None):
+    logger.debug("[get_user_preferences] Called with user_id=%s", user_id)
     rating_df = pd.read_csv(path_rating_df)
     df = pd.read_csv(path_anime_df)
 
     animes_watched_by_user = rating_df[rating_df.user_id == user_id]
+
+    # Rating events logged since rating_df was written replace older ratings of the same anime
+    deltas = load_rating_deltas() if deltas is None else deltas
+    deltas = deltas[deltas["user_id"] == user_id]
+    if len(deltas):
+        fresh = pd.DataFrame({
+            "user_id": user_id,
+            "anime_id": deltas["anime_id"],
+            "rating": deltas["rating"],
+        })
+        animes_watched_by_user = pd.concat([animes_watched_by_user, fresh]).drop_duplicates("anime_id", keep="last")
+
     user_rating_percentile = np.percentile(animes_watched_by_user.rating , 75)
 
     animes_watched_by_user = animes_watched_by_user[animes_watched_by_user.rating >= user_rating_percentile]
@@ -205,19 +310,20 @@ def get_user_preferences(user_id , path_rating_df , path_anime_df ):
     anime_df_rows = df[df["anime_id"].isin(top_animes_user)]
     anime_df_rows = anime_df_rows[["eng_version","Genres"]]
 
-    print("[get_user_preferences] User preference DataFrame created")
+    logger.debug("[get_user_preferences] User preference DataFrame created")
     return anime_df_rows
 
 
 ######## 6. USER RECOMMENDATION
 
-def get_user_recommendations(similar_users , user_pref ,path_anime_df , path_synopsis_df, path_rating_df, n=10):
-    print(f"[get_user_recommendations] Called with {len(similar_users)} similar users")
+def get_user_recommendations(similar_users , user_pref ,path_anime_df , path_synopsis_df, path_rating_df, n=10, deltas=None):
+    logger.debug("[get_user_recommendations] Called with %s similar users", len(similar_users))
     recommended_animes = []
     anime_list = []
+    deltas = load_rating_deltas() if deltas is None else deltas
 
     for user_id in similar_users.similar_users.values:
-        pref_list = get_user_preferences(int(user_id) , path_rating_df, path_anime_df)
+        pref_list = get_user_preferences(int(user_id) , path_rating_df, path_anime_df, deltas)
         pref_list = pref_list[~pref_list.eng_version.isin(user_pref.eng_version.values)]
 
         if not pref_list.empty:
@@ -242,5 +348,68 @@ def get_user_recommendations(similar_users , user_pref ,path_anime_df , path_syn
                     "Genres" : genre,
                     "Synopsis": synopsis
                 })
-    print("[get_user_recommendations] Final recommendations generated")
+    logger.debug("[get_user_recommendations] Final recommendations generated")
     return pd.DataFrame(recommended_animes).head(n)
+
+
+######## 7. DIRECT USER -> ANIME SCORING
+
+def get_seen_animes(encoded_user, path_ratings_index):
+    ratings_index = np.load(path_ratings_index)
+    indptr = ratings_index["indptr"]
+    return ratings_index["indices"][indptr[encoded_user]:indptr[encoded_user + 1]]
+
+
+def get_fresh_seen_animes(user_id, anime2anime_encoded, deltas):
+    # Encoded animes the user rated through the delta log, not yet in the ratings index
+    encoded = [anime2anime_encoded.get(int(anime_id)) for anime_id in deltas["anime_id"][deltas["user_id"] == user_id]]
+    return np.array([anime for anime in encoded if anime is not None], dtype=np.int64)
+
+
+def recommend_for_user(user_id, path_user_weights, path_anime_weights, path_user2user_encoded, path_anime2anime_decoded, path_ratings_index, path_anime_df, n=10, exclude_seen=True, include_genres=None, exclude_genres=None, deltas=None, path_anime2anime_encoded=ANIME2ANIME_ENCODED):
+    """
+    Scores the whole catalog for a user with one matrix-vector product of the
+    user embedding against the anime embeddings and returns the top-n animes.
+    """
+    logger.debug("[recommend_for_user] Called with user_id=%s, n=%s, exclude_seen=%s", user_id, n, exclude_seen)
+    user_weights = joblib.load(path_user_weights)
+    anime_weights = joblib.load(path_anime_weights)
+    user2user_encoded = joblib.load(path_user2user_encoded)
+    anime2anime_decoded = joblib.load(path_anime2anime_decoded)
+
+    encoded_index = user2user_encoded.get(user_id)
+    if encoded_index is None:
+        logger.warning("[recommend_for_user] Encoded index not found for user_id=%s", user_id)
+        return pd.DataFrame(columns=["anime_id", "name", "score", "genre"])
+
+    # Both tables are L2-normalised by extract_weights, so this is the cosine score
+    scores = np.dot(anime_weights, user_weights[encoded_index])
+
+    if exclude_seen:
+        scores[get_seen_animes(encoded_index, path_ratings_index)] = -np.inf
+        deltas = load_rating_deltas(path_ratings_index=path_ratings_index) if deltas is None else deltas
+        if len(deltas):
+            scores[get_fresh_seen_animes(user_id, joblib.load(path_anime2anime_encoded), deltas)] = -np.inf
+
+    allowed = get_genre_mask(include_genres, exclude_genres)
+    if allowed is not None:
+        scores[~allowed] = -np.inf
+
+    n = min(n, int(np.isfinite(scores).sum()))
+    if n <= 0:
+        return pd.DataFrame(columns=["anime_id", "name", "score", "genre"])
+
+    top = np.argpartition(-scores, n - 1)[:n]
+    top = top[np.argsort(-scores[top])]
+
+    anime_ids = [anime2anime_decoded.get(i) for i in top]
+    df = pd.read_csv(path_anime_df).set_index("anime_id")
+
+    recommendations = pd.DataFrame({
+        "anime_id": anime_ids,
+        "name": df.eng_version.reindex(anime_ids).values,
+        "score": scores[top],
+        "genre": df.Genres.reindex(anime_ids).values,
+    })
+    logger.debug("[recommend_for_user] Recommendation frame constructed")
+    return recommendations
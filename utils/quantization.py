@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import numpy as np
+from src.logger import get_logger
+from src.custom_exception import CustomException
+from config.paths_config import *
+
+logger = get_logger(__name__)
+
+QUANTIZATION_DTYPES = ("float16", "int8")
+
+### Only int8 is faster to score than its float32 upcast : NumPy has no fast
+### float16 -> float32 conversion, so float16 tables stay an offline report only.
+SERVING_QUANTIZATION_DTYPES = ("int8",)
+
+QUANTIZED_PARTS = ("values", "scales")
+
+
+def quantized_paths(prefix):
+    """ One plain .npy per part (prefix_values.npy, prefix_scales.npy) so every part can be memory-mapped """
+    return {part: f"{prefix}_{part}.npy" for part in QUANTIZED_PARTS}
+
+
+def quantize_embeddings(weights, dtype):
+    """
+    float16 keeps one half-precision matrix, int8 keeps an int8 matrix plus
+    one float32 scale per row (row ~= values * scale).
+    """
+    weights = np.asarray(weights, dtype=np.float32)
+
+    if dtype == "float16":
+        return {"values": weights.astype(np.float16)}
+
+    if dtype == "int8":
+        scales = np.abs(weights).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        values = np.rint(weights / scales[:, None]).astype(np.int8)
+        return {"values": values, "scales": scales.astype(np.float32)}
+
+    raise ValueError(f"Unsupported quantization dtype: {dtype}")
+
+
+def dequantize_embeddings(quantized):
+    values = quantized["values"].astype(np.float32)
+    if "scales" in quantized:
+        values *= quantized["scales"][:, None]
+    return values
+
+
+def save_quantized_embeddings(weights, prefix, dtype):
+    paths = quantized_paths(prefix)
+    for part, array in quantize_embeddings(weights, dtype).items():
+        np.save(paths[part], array)
+    logger.info(f"{dtype} embeddings saved to {prefix}_*.npy")
+
+
+def load_quantized_embeddings(prefix, mmap_mode=None):
+    return {part: np.load(path, mmap_mode=mmap_mode) for part, path in quantized_paths(prefix).items() if os.path.exists(path)}
+
+
+def quantized_scores(quantized, query, chunk_size=4096):
+    # Upcast block by block into one reused cache-sized buffer so BLAS does the
+    # work without a float32 copy of the table
+    values = quantized["values"]
+    query = np.asarray(query, dtype=np.float32)
+    scores = np.empty(len(values), dtype=np.float32)
+    buffer = np.empty((min(chunk_size, len(values)), values.shape[1]), dtype=np.float32)
+
+    for start in range(0, len(values), chunk_size):
+        stop = min(start + chunk_size, len(values))
+        block = buffer[:stop - start]
+        np.copyto(block, values[start:stop], casting="unsafe")
+        np.dot(block, query, out=scores[start:stop])
+
+    if "scales" in quantized:
+        scores *= quantized["scales"]
+    return scores
+
+
+def quantized_top_k(quantized, query, k, full_weights=None, rescore_factor=4, exclude=None):
+    """
+    Top-k rows by dot product with query, skipping the row indices in exclude.
+    Candidates are picked on the quantized matrix; when full_weights is given
+    (e.g. a memory-mapped float32 .npy) the k * rescore_factor best candidates
+    are rescored in full precision.
+    """
+    scores = quantized_scores(quantized, query)
+    if exclude is not None:
+        scores[exclude] = -np.inf
+
+    n_candidates = k * rescore_factor if full_weights is not None else k
+    n_candidates = min(n_candidates, int(np.isfinite(scores).sum()))
+    if n_candidates <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+
+    if full_weights is not None:
+        candidate_scores = np.dot(full_weights[candidates], query)
+    else:
+        candidate_scores = scores[candidates]
+
+    order = np.argsort(-candidate_scores)[:k]
+    return candidates[order], candidate_scores[order]
+
+
+def compare_quantization(weights, dtype, k=10, n_queries=200, rescore_factor=4, random_state=43):
+    """
+    Memory footprint, per-query latency and top-k agreement of the quantized
+    search (with and without full precision rescoring) against float32.
+    """
+    try:
+        weights = np.asarray(weights, dtype=np.float32)
+        quantized = quantize_embeddings(weights, dtype)
+
+        rng = np.random.default_rng(random_state)
+        queries = rng.choice(len(weights), size=min(n_queries, len(weights)), replace=False)
+        k = min(k, len(weights))
+
+        float32_time = quantized_time = rescored_time = 0.0
+        quantized_overlap = rescored_overlap = 0.0
+
+        for q in queries:
+            query = weights[q]
+
+            start = time.perf_counter()
+            scores = np.dot(weights, query)
+            exact = np.argpartition(-scores, k - 1)[:k]
+            float32_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            approx, _ = quantized_top_k(quantized, query, k)
+            quantized_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            rescored, _ = quantized_top_k(quantized, query, k, full_weights=weights, rescore_factor=rescore_factor)
+            rescored_time += time.perf_counter() - start
+
+            quantized_overlap += len(np.intersect1d(exact, approx)) / k
+            rescored_overlap += len(np.intersect1d(exact, rescored)) / k
+
+        n = len(queries)
+        return {
+            "dtype": dtype,
+            "rows": int(weights.shape[0]),
+            "dim": int(weights.shape[1]),
+            "float32_bytes": int(weights.nbytes),
+            "quantized_bytes": int(sum(v.nbytes for v in quantized.values())),
+            "float32_latency_ms": 1000 * float32_time / n,
+            "quantized_latency_ms": 1000 * quantized_time / n,
+            "rescored_latency_ms": 1000 * rescored_time / n,
+            f"recall@{k}": quantized_overlap / n,
+            f"rescored_recall@{k}": rescored_overlap / n,
+        }
+    except Exception as e:
+        logger.error(f"Error while comparing {dtype} quantization {e}")
+        raise CustomException("Failed to compare quantized embeddings", e)
+
+
+if __name__ == "__main__":
+    import joblib
+
+    report = {}
+    for name, path in [("user_weights", USER_WEIGHTS_PATH), ("anime_weights", ANIME_WEIGHTS_PATH)]:
+        weights = joblib.load(path)
+        report[name] = [compare_quantization(weights, dtype) for dtype in QUANTIZATION_DTYPES]
+
+    with open(QUANTIZATION_REPORT, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,161 @@
+import re
+import unicodedata
+import numpy as np
+
+### Title search over the catalog names (eng_version and the original Name).
+### Two NumPy structures, built once offline :
+###   - prefix keys : every normalised title and each of its word suffixes
+###     ("attack on titan", "on titan", "titan"), sorted, so a prefix query is
+###     two searchsorted calls ;
+###   - a character trigram inverted index in CSR layout (sorted grams, indptr,
+###     postings) used for fuzzy matching by trigram overlap (Dice coefficient).
+### A query never touches the CSV files.
+
+NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_title(title):
+    if not isinstance(title, str):
+        return ""
+    title = unicodedata.normalize("NFKD", title.casefold())
+    title = "".join(char for char in title if not unicodedata.combining(char))
+    return NON_ALNUM.sub(" ", title).strip()
+
+
+def title_grams(normalized, size=3):
+    padded = f"  {normalized} "
+    return sorted({padded[i:i + size] for i in range(len(padded) - size + 1)})
+
+
+def build_title_index(names, original_names=None):
+    """
+    Arrays of the title index for catalog rows named names[i] (and optionally
+    original_names[i]). Empty and duplicate spellings of a row are skipped.
+    """
+    entry_row, entry_text = [], []
+    for row, spellings in enumerate(zip(names, original_names if original_names is not None else [None] * len(names))):
+        seen = set()
+        for spelling in spellings:
+            text = normalize_title(spelling)
+            if text and text not in seen:
+                seen.add(text)
+                entry_row.append(row)
+                entry_text.append(text)
+
+    prefix_keys, prefix_entry, prefix_whole = [], [], []
+    for entry, text in enumerate(entry_text):
+        for start in [0] + [match.end() for match in re.finditer(" ", text)]:
+            prefix_keys.append(text[start:])
+            prefix_entry.append(entry)
+            prefix_whole.append(start == 0)
+
+    gram_postings = {}
+    gram_counts = np.zeros(len(entry_text), dtype=np.int32)
+    for entry, text in enumerate(entry_text):
+        grams = title_grams(text)
+        gram_counts[entry] = len(grams)
+        for gram in grams:
+            gram_postings.setdefault(gram, []).append(entry)
+
+    grams = sorted(gram_postings)
+    indptr = np.zeros(len(grams) + 1, dtype=np.int64)
+    np.cumsum([len(gram_postings[gram]) for gram in grams], out=indptr[1:])
+    postings = np.fromiter((entry for gram in grams for entry in gram_postings[gram]), dtype=np.int32, count=int(indptr[-1]))
+
+    order = np.argsort(np.array(prefix_keys, dtype=str), kind="stable")
+    return {
+        "entry_row": np.asarray(entry_row, dtype=np.int32),
+        "entry_text": np.array(entry_text, dtype=str),
+        "gram_counts": gram_counts,
+        "prefix_keys": np.array(prefix_keys, dtype=str)[order],
+        "prefix_entry": np.asarray(prefix_entry, dtype=np.int32)[order],
+        "prefix_whole": np.asarray(prefix_whole, dtype=bool)[order],
+        "entry_length": np.char.str_len(np.array(entry_text, dtype=str)).astype(np.int32),
+        "grams": np.array(grams, dtype=str),
+        "gram_indptr": indptr,
+        "gram_postings": postings,
+    }
+
+
+class TitleIndex:
+    """
+    Prefix and fuzzy lookup of catalog rows by title. Results are lists of
+    (catalog row, score) with the best match first and one entry per row.
+    """
+    def __init__(self, arrays):
+        self.entry_row = arrays["entry_row"]
+        self.entry_text = arrays["entry_text"]
+        self.gram_counts = arrays["gram_counts"]
+        self.prefix_keys = arrays["prefix_keys"]
+        self.prefix_entry = arrays["prefix_entry"]
+        self.prefix_whole = arrays["prefix_whole"]
+        self.entry_length = arrays["entry_length"]
+        self.grams = arrays["grams"]
+        self.gram_indptr = arrays["gram_indptr"]
+        self.gram_postings = arrays["gram_postings"]
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in arrays.files})
+
+    def _rows(self, entries, scores, n):
+        results, seen = [], set()
+        for entry, score in zip(entries, scores):
+            row = int(self.entry_row[entry])
+            if row not in seen:
+                seen.add(row)
+                results.append((row, float(score)))
+                if len(results) == n:
+                    break
+        return results
+
+    def prefix(self, query, n=10):
+        """ Titles with a word starting with query ; whole-title prefixes and shorter titles first """
+        query = normalize_title(query)
+        if not query:
+            return []
+
+        start = np.searchsorted(self.prefix_keys, query, side="left")
+        stop = np.searchsorted(self.prefix_keys, query + "\uffff", side="left")
+        entries = self.prefix_entry[start:stop]
+        if len(entries) == 0:
+            return []
+
+        lengths = self.entry_length[entries]
+        order = np.lexsort((lengths, ~self.prefix_whole[start:stop]))
+        scores = len(query) / lengths[order]
+        return self._rows(entries[order], scores, n)
+
+    def fuzzy(self, query, n=10, min_score=0.3):
+        """ Titles sharing the most character trigrams with query (Dice coefficient) """
+        query = normalize_title(query)
+        if not query:
+            return []
+
+        query_grams = title_grams(query)
+        positions = np.searchsorted(self.grams, query_grams)
+        found = positions < len(self.grams)
+        found[found] = self.grams[positions[found]] == np.array(query_grams, dtype=str)[found]
+        positions = positions[found]
+        if len(positions) == 0:
+            return []
+
+        postings = np.concatenate([self.gram_postings[self.gram_indptr[p]:self.gram_indptr[p + 1]] for p in positions])
+        shared = np.bincount(postings, minlength=len(self.entry_text))
+
+        candidates = np.flatnonzero(shared)
+        scores = 2.0 * shared[candidates] / (len(query_grams) + self.gram_counts[candidates])
+        keep = scores >= min_score
+        candidates, scores = candidates[keep], scores[keep]
+
+        order = np.argsort(-scores, kind="stable")
+        return self._rows(candidates[order], scores[order], n)
+
+    def search(self, query, n=10, fuzzy=True):
+        """ Prefix matches first, then fuzzy matches for misspelled or partial titles """
+        results = self.prefix(query, n)
+        if fuzzy and len(results) < n:
+            seen = {row for row, _ in results}
+            results += [(row, score) for row, score in self.fuzzy(query, n + len(results)) if row not in seen]
+        return results[:n]